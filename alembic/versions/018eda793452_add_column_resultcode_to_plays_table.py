@@ -0,0 +1,25 @@
+"""add column resultCode to plays table
+
+Revision ID: 018eda793452
+Revises: 3aa4e3d25563
+Create Date: 2026-10-18 19:12:40.518306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '018eda793452'
+down_revision = '3aa4e3d25563'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('plays', sa.Column('resultCode', sa.SmallInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    # a batch rebuild would lose WITHOUT ROWID, SQLite 3.35+ drops the column in place
+    op.execute('ALTER TABLE plays DROP COLUMN "resultCode"')
@@ -0,0 +1,34 @@
+"""create table ingest_checkpoints
+
+Revision ID: 3aa4e3d25563
+Revises: f3ca653721fb
+Create Date: 2026-10-18 16:02:47.905113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3aa4e3d25563'
+down_revision = 'f3ca653721fb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'ingest_checkpoints',
+        sa.Column('gameId', sa.Integer, sa.ForeignKey('games.id'), primary_key=True, autoincrement=False),
+        sa.Column('nPlays', sa.Integer, nullable=False),
+        sa.Column('finishedAt', sa.DateTime, nullable=False),
+    )
+    # games loaded before checkpoints existed are done, otherwise ingest.ingest_games would fetch them all again
+    op.execute(
+        'INSERT INTO ingest_checkpoints ("gameId", "nPlays", "finishedAt") '
+        'SELECT "gameId", COUNT(*), CURRENT_TIMESTAMP FROM plays GROUP BY "gameId"'
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('ingest_checkpoints')
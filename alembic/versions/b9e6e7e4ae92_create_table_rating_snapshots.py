@@ -0,0 +1,31 @@
+"""create table rating_snapshots
+
+Revision ID: b9e6e7e4ae92
+Revises: ebf8098f78d2
+Create Date: 2026-10-18 10:12:41.532087
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b9e6e7e4ae92'
+down_revision = 'ebf8098f78d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'rating_snapshots',
+        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column('model', sa.String(255), nullable=False),
+        sa.Column('version', sa.Integer, nullable=False),
+        sa.Column('createdAt', sa.DateTime, nullable=False),
+        sa.Column('data', sa.LargeBinary, nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rating_snapshots')
@@ -0,0 +1,45 @@
+"""backfill resultCode and index plays by it
+
+Revision ID: bfc94a10ffb8
+Revises: 018eda793452
+Create Date: 2026-10-18 20:03:27.640153
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sys import stderr
+
+
+# revision identifiers, used by Alembic.
+revision = 'bfc94a10ffb8'
+down_revision = '018eda793452'
+branch_labels = None
+depends_on = None
+
+
+# models.Result as of this revision, raw event names are coded by data_clean.clean_play_outcomes
+RESULT_CODES = {'DNS': 0, 'Out': 1, 'Walk': 2, 'Single': 3, 'Double': 4, 'Triple': 5, 'Home Run': 6}
+
+
+def upgrade() -> None:
+    print('Backfilling plays.resultCode...', file=stderr)
+    cases = ' '.join(f"WHEN '{result}' THEN {code}" for result, code in RESULT_CODES.items())
+    op.execute(f'UPDATE plays SET "resultCode" = CASE result {cases} END WHERE "resultCode" IS NULL')
+
+    # the per-result indexes now key on the small integer instead of the string
+    op.drop_index('ix_plays_pitcherId_result', 'plays')
+    op.drop_index('ix_plays_batterId_result', 'plays')
+    op.drop_index('ix_plays_result', 'plays')
+    op.create_index('ix_plays_pitcherId_resultCode', 'plays', ['pitcherId', 'resultCode'])
+    op.create_index('ix_plays_batterId_resultCode', 'plays', ['batterId', 'resultCode'])
+    op.create_index('ix_plays_resultCode', 'plays', ['resultCode'])
+    op.execute('ANALYZE')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_plays_resultCode', 'plays')
+    op.drop_index('ix_plays_batterId_resultCode', 'plays')
+    op.drop_index('ix_plays_pitcherId_resultCode', 'plays')
+    op.create_index('ix_plays_pitcherId_result', 'plays', ['pitcherId', 'result'])
+    op.create_index('ix_plays_batterId_result', 'plays', ['batterId', 'result'])
+    op.create_index('ix_plays_result', 'plays', ['result'])
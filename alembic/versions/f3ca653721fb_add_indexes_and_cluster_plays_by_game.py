@@ -0,0 +1,75 @@
+"""add indexes and cluster plays by game
+
+Revision ID: f3ca653721fb
+Revises: b9e6e7e4ae92
+Create Date: 2026-10-18 14:31:05.118420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sys import stderr
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3ca653721fb'
+down_revision = 'b9e6e7e4ae92'
+branch_labels = None
+depends_on = None
+
+
+PLAY_COLUMNS = '"gameId", "atBatIndex", result, "pitcherId", "batterId", inning, outs, "runnersOn"'
+
+
+def upgrade() -> None:
+    print('Rebuilding plays as a WITHOUT ROWID table clustered on (gameId, atBatIndex)...', file=stderr)
+    op.create_table(
+        'plays_new',
+        sa.Column('gameId', sa.Integer, sa.ForeignKey('games.id'), primary_key=True, autoincrement=False),
+        sa.Column('atBatIndex', sa.Integer, primary_key=True, autoincrement=False),
+        sa.Column('result', sa.String(255)),
+        sa.Column('pitcherId', sa.Integer, sa.ForeignKey('pitchers.playerId')),
+        sa.Column('batterId', sa.Integer, sa.ForeignKey('batters.playerId')),
+        sa.Column('inning', sa.Integer),
+        sa.Column('outs', sa.Integer),
+        sa.Column('runnersOn', sa.Integer),
+        sqlite_with_rowid=False,
+    )
+
+    # duplicate at-bats and at-bats without an index cannot be part of the new key and are dropped
+    op.execute(f"INSERT OR IGNORE INTO plays_new ({PLAY_COLUMNS}) SELECT {PLAY_COLUMNS} FROM plays ORDER BY id")
+    op.drop_table('plays')
+    op.rename_table('plays_new', 'plays')
+
+    print('Adding indexes...', file=stderr)
+    op.create_index('ix_plays_pitcherId_result', 'plays', ['pitcherId', 'result'])
+    op.create_index('ix_plays_batterId_result', 'plays', ['batterId', 'result'])
+    op.create_index('ix_plays_result', 'plays', ['result'])
+    op.create_index('ix_games_training_date', 'games', ['training', 'date', 'id'])
+    op.create_index('ix_games_date', 'games', ['date'])
+    op.create_index('ix_pitchers_playerId', 'pitchers', ['playerId'])
+    op.create_index('ix_batters_playerId', 'batters', ['playerId'])
+    op.execute('ANALYZE')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_batters_playerId', 'batters')
+    op.drop_index('ix_pitchers_playerId', 'pitchers')
+    op.drop_index('ix_games_date', 'games')
+    op.drop_index('ix_games_training_date', 'games')
+
+    op.create_table(
+        'plays_old',
+        sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column('gameId', sa.Integer, sa.ForeignKey('games.id')),
+        sa.Column('result', sa.String(255)),
+        sa.Column('pitcherId', sa.Integer, sa.ForeignKey('pitchers.playerId')),
+        sa.Column('batterId', sa.Integer, sa.ForeignKey('batters.playerId')),
+        sa.Column('atBatIndex', sa.Integer),
+        sa.Column('training', sa.Boolean, nullable=False, server_default=sa.text('true')),
+        sa.Column('inning', sa.Integer),
+        sa.Column('outs', sa.Integer),
+        sa.Column('runnersOn', sa.Integer),
+    )
+    op.execute(f"INSERT INTO plays_old ({PLAY_COLUMNS}) SELECT {PLAY_COLUMNS} FROM plays")
+    op.drop_table('plays')
+    op.rename_table('plays_old', 'plays')
@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+CACHE_DIR = 'data/api_cache'
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+def _statsapi():
+    # imported on first network request, so cache-only runs do not need statsapi installed
+    import statsapi
+    return statsapi
+
+
+def cache_key(endpoint: str, params: dict) -> str:
+    """Content address of a request, the same endpoint and params always map to the same key"""
+    request = json.dumps([endpoint, params], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(request.encode()).hexdigest()
+
+
+class ApiCache:
+    """Gzipped JSON copies of raw statsapi responses, stored under CACHE_DIR/<key[:2]>/<key>.json.gz
+
+        Historical responses never change, so a cached response is always served instead of refetching.
+        With cache_only=True nothing is fetched and a missing response raises CacheMiss, so the database
+        can be rebuilt entirely from local disk.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, cache_only: bool = False):
+        self.directory = directory
+        self.cache_only = cache_only
+
+    def path(self, endpoint: str, params: dict) -> str:
+        key = cache_key(endpoint, params)
+        return os.path.join(self.directory, key[:2], key + '.json.gz')
+
+    def load(self, endpoint: str, params: dict):
+        try:
+            with gzip.open(self.path(endpoint, params), 'rt') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise CacheMiss(f"No cached response for {endpoint} {params}") from None
+
+    def put(self, endpoint: str, params: dict, response):
+        """Store a response, written to a temporary file first so readers never see a partial entry"""
+        path = self.path(endpoint, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt') as f:
+            json.dump(response, f)
+        os.replace(tmp, path)
+
+    def fetch(self, endpoint: str, params: dict, request):
+        try:
+            return self.load(endpoint, params)
+        except CacheMiss:
+            if self.cache_only:
+                raise
+        response = request()
+        self.put(endpoint, params, response)
+        return response
+
+    def get(self, endpoint: str, params: dict):
+        """Cached statsapi.get"""
+        return self.fetch(endpoint, params, lambda: _statsapi().get(endpoint, params))
+
+    def schedule(self, **kwargs) -> list[dict]:
+        """Cached statsapi.schedule, keyed by its keyword arguments"""
+        return self.fetch('schedule', kwargs, lambda: _statsapi().schedule(**kwargs))
@@ -0,0 +1,127 @@
+import sys
+from collections import namedtuple
+from datetime import timedelta
+
+import numpy as np
+
+from db_utils import create_session_scope
+from elo_engine import player_indices
+from evaluation import evaluate, write_report
+from parallel_evaluation import shared_plays_pool, worker_state
+from models import PitcherOutcome, Position
+from play_store import PlayStore, load_play_store
+from prediction_model import EloModel, results_table, partial_results_table
+
+# train on [train_start, train_end), test on [train_end, test_end)
+Window = namedtuple('Window', ['train_start', 'train_end', 'test_end'])
+
+
+def rolling_windows(first_date, last_date, train_days: int, test_days: int, step_days: int = None, expanding=False) -> list[Window]:
+    """Walk-forward windows over [first_date, last_date], each test period following its training period
+
+        Windows move forward by step_days (test_days by default). With expanding=True every window trains
+        from first_date instead of keeping a fixed train_days length.
+    """
+    step = timedelta(days=step_days or test_days)
+    windows = []
+    train_start, train_end = first_date, first_date + timedelta(days=train_days)
+    while train_end <= last_date:
+        windows.append(Window(train_start, train_end, min(train_end + timedelta(days=test_days), last_date + timedelta(days=1))))
+        train_end += step
+        if not expanding:
+            train_start += step
+    return windows
+
+
+def pitcher_outcome_counts(plays: PlayStore, pitcher_ids: np.ndarray):
+    """(n_plays, outcome_counts) of every pitcher over just these plays, like data_clean.assign_outcomes does over the table"""
+    index = player_indices(pitcher_ids, plays.pitcherId.astype(np.int64))
+    n_plays = np.bincount(index, minlength=len(pitcher_ids))
+    outcome_counts = np.zeros((len(pitcher_ids), len(PitcherOutcome.outcome_columns)), dtype=np.int64)
+    for column, result in enumerate(PitcherOutcome.result_columns):
+        outcome_counts[:, column] = np.bincount(index[plays.result == result], minlength=len(pitcher_ids))
+    return n_plays, outcome_counts
+
+
+def window_plays(plays: PlayStore, start, end) -> PlayStore:
+    # plays are in date order, so a window is a contiguous slice
+    dates = np.array([start, end], dtype='datetime64[D]')
+    first, last = np.searchsorted(plays.date, dates, side='left')
+    return plays.select(slice(int(first), int(last)))
+
+
+def run_window(base_model: EloModel, plays: PlayStore, window: Window,
+               results_table=results_table, partial_results_table=partial_results_table) -> dict:
+    """Train a fresh copy of base_model on the window's training plays and evaluate it on the plays that follow"""
+    training_plays = window_plays(plays, window.train_start, window.train_end)
+    testing_plays = window_plays(plays, window.train_end, window.test_end)
+
+    model = base_model.copy()
+    model.reset_ratings()
+    model.set_results_tables(results_table, partial_results_table)
+    # hit-type frequencies may only come from the training window, the test plays are unseen
+    model.set_outcome_counts(*pitcher_outcome_counts(training_plays, model.player_ids[Position.PITCHER.value]))
+    model.fit(training_plays)
+
+    return {
+        'train_start': window.train_start.isoformat(),
+        'train_end': window.train_end.isoformat(),
+        'test_end': window.test_end.isoformat(),
+        'n_training_plays': len(training_plays),
+        **evaluate(model, testing_plays, results_table, partial_results_table),
+    }
+
+
+def aggregate(results: list[dict]) -> dict:
+    """Mean, standard deviation, min and max of every metric across windows"""
+    metrics = [key for key, value in results[0].items() if isinstance(value, float)]
+    summary = {}
+    for metric in metrics:
+        values = np.array([result[metric] for result in results])
+        summary[metric] = {'mean': float(values.mean()), 'std': float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+                           'min': float(values.min()), 'max': float(values.max())}
+    return summary
+
+
+def _run_window(window: Window):
+    return run_window(worker_state['base_model'], worker_state['plays'], window)
+
+
+def backtest(base_model: EloModel, plays: PlayStore, windows: list[Window], max_workers: int = None) -> dict:
+    """Run every walk-forward window in a process pool over one memory-mapped copy of all plays
+
+        The training column is never read or written, each window picks its own plays by date.
+    """
+    windows = [window for window in windows if len(window_plays(plays, window.train_end, window.test_end))]
+    if not windows:
+        raise ValueError("No window has any plays to test on")
+    with shared_plays_pool({'plays': plays}, {'base_model': base_model}, max_workers) as pool:
+        results = list(pool.map(_run_window, windows))
+
+    return {
+        'n_windows': len(results),
+        'summary': aggregate(results),
+        'windows': results,
+    }
+
+
+def main():
+    # usage: python backtest.py [train_days test_days [step_days [expanding]]] [report.json]
+    args = [arg for arg in sys.argv[1:] if not arg.endswith('.json')]
+    path = next((arg for arg in sys.argv[1:] if arg.endswith('.json')), None)
+    train_days = int(args[0]) if len(args) > 0 else 60
+    test_days = int(args[1]) if len(args) > 1 else 14
+    step_days = int(args[2]) if len(args) > 2 else None
+    expanding = len(args) > 3 and args[3] == 'expanding'
+
+    with create_session_scope() as session:
+        base_model = EloModel(session)
+        plays = load_play_store(session, training=None)
+
+    windows = rolling_windows(plays.date[0].item(), plays.date[-1].item(), train_days, test_days, step_days, expanding)
+    print(f"Backtesting {len(windows)} windows...")
+    write_report(backtest(base_model, plays, windows), path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Checks elo_engine.simulate_games against a per-play reference loop and times both on a synthetic season.
+
+    python benchmark_elo.py [n_games]   defaults to a full 2430-game season
+
+The reference is the loop simulate_elo ran before the kernel, with dict ratings, utils.calculate_ev per play
+and its shared-accumulator bug fixed, i.e. the intended per-game semantics. Both sides are timed best of
+RUNS from plays already in memory. The kernel is simulate_games over indices and independent blocks that
+EloModel.fit works out once per season, their cost is printed separately. Exits with status 1 if the
+ratings differ or the kernel is less than MIN_SPEEDUP times faster than the reference.
+"""
+import sys
+import time
+
+import numpy as np
+
+from elo_engine import simulate_games, independent_blocks, player_indices
+from play_store import PlayStore, RESULTS
+from prediction_model import results_table
+from utils import calculate_ev, SIGMA, INITIAL_RATING
+
+N_GAMES = 2430
+PLAYS_PER_GAME = 76
+N_TEAMS = 30
+# a team's pitching staff and the batters it uses over the season
+STAFF_SIZE = 13
+LINEUP_SIZE = 13
+# roughly the league's result mix, in Result code order (DNS, Out, Walk, Single, Double, Triple, Home Run)
+RESULT_FREQUENCIES = [0.01, 0.67, 0.09, 0.14, 0.05, 0.005, 0.035]
+K = 16
+TOLERANCE = 1e-9
+MIN_SPEEDUP = 20
+RUNS = 5
+
+
+def synthetic_season(n_games: int = N_GAMES, seed: int = 0) -> PlayStore:
+    """n_games games of PLAYS_PER_GAME plays between N_TEAMS teams, each team playing once a day
+
+        Each half of a game pits a few pitchers of one team's staff against that team's opponent's batters.
+    """
+    rng = np.random.default_rng(seed)
+    n = n_games * PLAYS_PER_GAME
+    games_per_day = N_TEAMS // 2
+    matchups = np.concatenate([rng.permutation(N_TEAMS) for _ in range(-(-n_games // games_per_day))])[:2 * n_games].reshape(n_games, 2)
+    game_ids = np.repeat(np.arange(n_games), PLAYS_PER_GAME)
+    # the first half of a game's plays is the top of the innings: the home team pitches to the away team
+    home_bats = (np.arange(n) % PLAYS_PER_GAME) >= PLAYS_PER_GAME // 2
+    batting_team = matchups[game_ids, home_bats.astype(int)]
+    pitching_team = matchups[game_ids, 1 - home_bats.astype(int)]
+    pitcher_ids = pitching_team * STAFF_SIZE + rng.integers(0, 4, n) + 1
+    batter_ids = batting_team * LINEUP_SIZE + rng.integers(0, LINEUP_SIZE, n) + 100_000
+    dates = np.datetime64('2021-04-01') + game_ids // games_per_day
+    results = rng.choice(len(RESULTS), n, p=RESULT_FREQUENCIES)
+    return PlayStore(game_ids, dates, pitcher_ids, batter_ids, results, np.ones(n), np.zeros(n), np.zeros(n))
+
+
+def reference_simulate(games: list[list[tuple]], pitcher_ratings: dict, batter_ratings: dict):
+    """The per-play loop over (pitcherId, batterId, result) rows, one accumulator per player and game"""
+    for game in games:
+        pitcher_rewards = {}
+        batter_rewards = {}
+        for pitcher_id, batter_id, result in game:
+            s_b = results_table[result]
+            if s_b == -1:
+                continue
+            e_b = calculate_ev(batter_ratings[batter_id], pitcher_ratings[pitcher_id])
+            pitcher_reward = pitcher_rewards.setdefault(pitcher_id, [0, 0])
+            batter_reward = batter_rewards.setdefault(batter_id, [0, 0])
+            pitcher_reward[0] += 1 - e_b
+            pitcher_reward[1] += 1 - s_b
+            batter_reward[0] += e_b
+            batter_reward[1] += s_b
+        for pitcher_id, (e_p, s_p) in pitcher_rewards.items():
+            pitcher_ratings[pitcher_id] += K * (s_p - e_p)
+        for batter_id, (e_b, s_b) in batter_rewards.items():
+            batter_ratings[batter_id] += K * (s_b - e_b)
+
+
+def prepare_season(plays: PlayStore, pitcher_ids: np.ndarray, batter_ids: np.ndarray):
+    """What EloModel.fit works out once per season: scored plays, their scores, rating indices and independent blocks"""
+    result_scores = np.array([results_table[result] for result in RESULTS], dtype=np.float64)
+    plays = plays.select(result_scores[plays.result] != -1)
+    pitcher_index, batter_index = player_indices(pitcher_ids, plays.pitcherId), player_indices(batter_ids, plays.batterId)
+    return pitcher_index, batter_index, result_scores[plays.result], independent_blocks(pitcher_index, batter_index, plays.game_bounds())
+
+
+def kernel_simulate(season, n_pitchers: int, n_batters: int):
+    """The per-season pass of EloModel.fit: simulate_games over the prepared blocks"""
+    pitcher_ratings = np.full(n_pitchers, INITIAL_RATING, dtype=np.float64)
+    batter_ratings = np.full(n_batters, INITIAL_RATING, dtype=np.float64)
+    pitcher_index, batter_index, scores, blocks = season
+    simulate_games(pitcher_ratings, batter_ratings, pitcher_index, batter_index, scores, blocks, K, SIGMA)
+    return pitcher_ratings, batter_ratings
+
+
+def best_of(runs: int, function, *args):
+    """(seconds of the fastest of runs calls, result of the last call)"""
+    seconds = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = min(seconds, time.perf_counter() - start)
+    return seconds, result
+
+
+def main():
+    n_games = int(sys.argv[1]) if len(sys.argv) > 1 else N_GAMES
+    plays = synthetic_season(n_games)
+    pitcher_ids, batter_ids = np.unique(plays.pitcherId).astype(np.int64), np.unique(plays.batterId).astype(np.int64)
+    bounds = plays.game_bounds()
+    rows = list(zip(plays.pitcherId.tolist(), plays.batterId.tolist(), [RESULTS[code] for code in plays.result.tolist()]))
+    games = [rows[start:end] for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+    def reference():
+        pitcher_table = dict.fromkeys(pitcher_ids.tolist(), float(INITIAL_RATING))
+        batter_table = dict.fromkeys(batter_ids.tolist(), float(INITIAL_RATING))
+        reference_simulate(games, pitcher_table, batter_table)
+        return pitcher_table, batter_table
+
+    reference_seconds, (pitcher_table, batter_table) = best_of(RUNS, reference)
+    prepare_seconds, season = best_of(RUNS, prepare_season, plays, pitcher_ids, batter_ids)
+    kernel_seconds, (pitcher_ratings, batter_ratings) = best_of(RUNS, kernel_simulate, season, len(pitcher_ids), len(batter_ids))
+
+    difference = max(np.abs(pitcher_ratings - np.array([pitcher_table[i] for i in pitcher_ids.tolist()])).max(),
+                     np.abs(batter_ratings - np.array([batter_table[i] for i in batter_ids.tolist()])).max())
+    print(f"{n_games} games, {len(plays)} plays")
+    print(f"max rating difference: {difference:.3g} (tolerance {TOLERANCE:g})")
+    speedup = reference_seconds / kernel_seconds
+    print(f"reference loop: {reference_seconds * 1000:10.1f} ms")
+    print(f"preparation:    {prepare_seconds * 1000:10.1f} ms  (indices and blocks, once per season)")
+    print(f"kernel:         {kernel_seconds * 1000:10.1f} ms  ({speedup:.1f}x, {reference_seconds / (prepare_seconds + kernel_seconds):.1f}x with preparation)")
+    if not difference <= TOLERANCE:
+        print("simulate_games does not match the reference loop")
+        sys.exit(1)
+    if speedup < MIN_SPEEDUP:
+        print(f"simulate_games is less than {MIN_SPEEDUP}x faster than the reference loop")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Times the loader and aggregation queries against the database, with their query plans.
+
+    python benchmark_queries.py           benchmark data/mlb.db as it is
+    python benchmark_queries.py compare   benchmark data/mlb.db before and after upgrading a copy to head
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from models import DB_FILE
+from play_store import PLAYS_QUERY, plays_query
+
+N_REPEATS = 3
+# the per-player queries are run this many times, as data_clean runs them once per player
+N_PLAYERS = 200
+
+# queries against plays.resultCode, the integer result code
+QUERIES = {
+    'load training plays': (PLAYS_QUERY, {'training': True}),
+    'load testing plays': (PLAYS_QUERY, {'training': False}),
+    'count plays per pitcher (get_number_of_games)': ('SELECT COUNT(*) FROM plays WHERE "pitcherId" = :player_id', None),
+    'count plays per batter (get_number_of_games)': ('SELECT COUNT(*) FROM plays WHERE "batterId" = :player_id', None),
+    'count outs per pitcher (assign_outcomes)': ('SELECT COUNT(*) FROM plays WHERE "pitcherId" = :player_id AND "resultCode" = 1', None),
+    'outcomes grouped by pitcher': ('SELECT "pitcherId", "resultCode", COUNT(*) FROM plays GROUP BY "pitcherId", "resultCode"', {}),
+    'plays of one result': ('SELECT COUNT(*) FROM plays WHERE "resultCode" = 6', {}),
+}
+
+# the same queries against the result string, for databases from before plays.resultCode
+STRING_PLAYS_QUERY = plays_query('WHERE games.training = :training', result='plays.result')
+STRING_QUERIES = {
+    'load training plays': (STRING_PLAYS_QUERY, {'training': True}),
+    'load testing plays': (STRING_PLAYS_QUERY, {'training': False}),
+    'count plays per pitcher (get_number_of_games)': QUERIES['count plays per pitcher (get_number_of_games)'],
+    'count plays per batter (get_number_of_games)': QUERIES['count plays per batter (get_number_of_games)'],
+    'count outs per pitcher (assign_outcomes)': ('SELECT COUNT(*) FROM plays WHERE "pitcherId" = :player_id AND result = \'Out\'', None),
+    'outcomes grouped by pitcher': ('SELECT "pitcherId", result, COUNT(*) FROM plays GROUP BY "pitcherId", result', {}),
+    'plays of one result': ('SELECT COUNT(*) FROM plays WHERE result = \'Home Run\'', {}),
+}
+
+
+def queries_for(connection: sqlite3.Connection) -> dict:
+    """QUERIES, or STRING_QUERIES when the plays table has no resultCode column yet"""
+    columns = {row[1] for row in connection.execute('PRAGMA table_info(plays)')}
+    return QUERIES if 'resultCode' in columns else STRING_QUERIES
+
+
+def run_benchmarks(db_file: str) -> dict:
+    """Best-of-N seconds and query plan of every query in QUERIES, or STRING_QUERIES on an older schema"""
+    connection = sqlite3.connect(db_file)
+    player_ids = [row[0] for row in connection.execute('SELECT "playerId" FROM pitchers LIMIT ?', (N_PLAYERS,))]
+    results = {}
+    for name, (query, params) in queries_for(connection).items():
+        # a None params entry marks a per-player query
+        param_sets = [{'player_id': player_id} for player_id in player_ids] if params is None else [params]
+        plan = [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + query, param_sets[0] if param_sets else {})]
+        best = float('inf')
+        for _ in range(N_REPEATS):
+            start = time.perf_counter()
+            for param_set in param_sets:
+                connection.execute(query, param_set).fetchall()
+            best = min(best, time.perf_counter() - start)
+        results[name] = (best, plan)
+    connection.close()
+    return results
+
+
+def upgrade_copy(db_file: str, directory: str) -> str:
+    from alembic import command
+    from alembic.config import Config
+
+    copy_file = os.path.join(directory, os.path.basename(db_file))
+    shutil.copy(db_file, copy_file)
+    config = Config('alembic.ini')
+    config.set_main_option('sqlalchemy.url', 'sqlite:///' + copy_file)
+    command.upgrade(config, 'head')
+    return copy_file
+
+
+def print_results(results: dict, before: dict = None):
+    for name, (seconds, plan) in results.items():
+        line = f"{name:<48} {seconds * 1000:>10.2f} ms"
+        if before is not None:
+            line += f"  (before {before[name][0] * 1000:.2f} ms, {before[name][0] / seconds:.1f}x)"
+        print(line)
+        for step in plan:
+            print(f"    {step}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        before = run_benchmarks(DB_FILE)
+        with tempfile.TemporaryDirectory() as directory:
+            after = run_benchmarks(upgrade_copy(DB_FILE, directory))
+        print_results(after, before)
+    else:
+        print_results(run_benchmarks(DB_FILE))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from db_utils import create_session_scope
+from evaluation import play_terms, metrics_from_totals, write_report
+from play_store import PlayStore, load_play_store
+from prediction_model import PredictionModel, EloModel, DumbModel, RandomModel, results_table, partial_results_table
+
+N_RESAMPLES = 10_000
+# resamples drawn per matrix product, bounds the (batch x n_games) weight matrix
+BATCH_SIZE = 256
+
+
+def game_totals(plays: PlayStore, terms: np.ndarray) -> np.ndarray:
+    """Sum the per-play terms of each game, an (n_games x n_terms) matrix"""
+    if not len(plays):
+        return np.zeros((0, terms.shape[1]))
+    return np.add.reduceat(terms, plays.game_bounds()[:-1], axis=0)
+
+
+def resample_totals(totals: np.ndarray, n_resamples: int, seed) -> np.ndarray:
+    """Totals of n_resamples bootstrap samples of whole games, an (n_resamples x n_terms) matrix
+
+        Each sample draws n_games games with replacement, expressed as multinomial game weights so that
+        a whole batch of samples is a single matrix product with the per-game totals.
+    """
+    rng = np.random.default_rng(seed)
+    n_games = len(totals)
+    samples = np.empty((n_resamples, totals.shape[1]))
+    for start in range(0, n_resamples, BATCH_SIZE):
+        weights = rng.multinomial(n_games, np.full(n_games, 1 / n_games), size=min(BATCH_SIZE, n_resamples - start))
+        samples[start:start + len(weights)] = weights @ totals
+    return samples
+
+
+def _resample(args):
+    return resample_totals(*args)
+
+
+def bootstrap_totals(totals: np.ndarray, n_resamples: int = N_RESAMPLES, seed: int = None, max_workers: int = None) -> np.ndarray:
+    """resample_totals split across a process pool, each worker with an independent random stream"""
+    max_workers = min(max_workers or os.cpu_count(), n_resamples)
+    sizes = [len(part) for part in np.array_split(np.arange(n_resamples), max_workers)]
+    seeds = np.random.SeedSequence(seed).spawn(max_workers)
+    if max_workers == 1:
+        return resample_totals(totals, n_resamples, seeds[0])
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return np.concatenate(list(pool.map(_resample, [(totals, size, seed) for size, seed in zip(sizes, seeds)])))
+
+
+def confidence_intervals(plays: PlayStore, hit: np.ndarray, partial: np.ndarray, outcomes: np.ndarray,
+                         results_table=results_table, partial_results_table=partial_results_table,
+                         n_resamples: int = N_RESAMPLES, confidence: float = 0.95, seed: int = None, max_workers: int = None) -> dict:
+    """Percentile bootstrap intervals of every metric, resampling games rather than plays
+
+        Plays within a game share pitchers and conditions, so games are the independent unit.
+        returns: {metric: {'estimate', 'low', 'high', 'std'}}
+    """
+    totals = game_totals(plays, play_terms(plays, hit, partial, outcomes, results_table, partial_results_table))
+    estimates = metrics_from_totals(totals.sum(axis=0))
+    samples = metrics_from_totals(bootstrap_totals(totals, n_resamples, seed, max_workers))
+
+    tail = (1 - confidence) / 2 * 100
+    intervals = {}
+    for metric, estimate in estimates.items():
+        if metric.startswith('n_'):
+            continue
+        low, high = np.nanpercentile(samples[metric], [tail, 100 - tail])
+        intervals[metric] = {'estimate': estimate, 'low': float(low), 'high': float(high), 'std': float(np.nanstd(samples[metric]))}
+    return intervals
+
+
+def bootstrap_model(model: PredictionModel, plays: PlayStore, **kwargs) -> dict:
+    """Replay the plays once on a copy of the model, then bootstrap its metrics from those predictions"""
+    hit, partial, outcomes = model.copy().replay_many(plays)
+    return confidence_intervals(plays, hit, partial, outcomes, **kwargs)
+
+
+def main():
+    # usage: python bootstrap.py [n_resamples] [report.json]
+    n_resamples = int(sys.argv[1]) if len(sys.argv) > 1 else N_RESAMPLES
+    with create_session_scope() as session:
+        testing_plays = load_play_store(session, training=False)
+        models = {
+            "Elo": EloModel(session),
+            "Baseline": DumbModel(),
+            "Random": RandomModel(),
+        }
+
+    report = {
+        'n_test_plays': len(testing_plays),
+        'n_test_games': testing_plays.n_games(),
+        'n_resamples': n_resamples,
+        'models': {name: bootstrap_model(model, testing_plays, n_resamples=n_resamples) for name, model in models.items()},
+    }
+    write_report(report, sys.argv[2] if len(sys.argv) > 2 else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import glob
+import json
+import os
+import sys
+from datetime import datetime
+
+from sqlalchemy import select, func
+from sqlalchemy.engine import Connection, Engine
+
+from models import engine, Base, Team, Player, Pitcher, Batter, PitcherOutcome, PitcherRating, BatterRating, Game, Play, IngestCheckpoint
+from ingest import game_row, play_rows, fixture_fetcher, unique_games
+from api_cache import ApiCache
+from utils import INITIAL_RATING
+
+DATA_DIR = 'data'
+
+
+def read_json(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+
+def next_id(connection: Connection, *tables) -> int:
+    """First free primary key across the given tables, ids are handed out up front instead of per-row flushes"""
+    return max(connection.execute(select(func.coalesce(func.max(t.c.id), 0))).scalar() for t in tables) + 1
+
+
+def insert_or_ignore(connection: Connection, model, rows: list[dict]):
+    if rows:
+        connection.execute(model.__table__.insert().prefix_with('OR IGNORE'), rows)
+
+
+def load_teams(connection: Connection, path: str) -> int:
+    rows = [{'id': t['id'], 'name': t['name'], 'abbreviation': t['abbreviation'], 'locationName': t['locationName']}
+            for t in read_json(path)['teams']]
+    insert_or_ignore(connection, Team, rows)
+    return len(rows)
+
+
+def load_players(connection: Connection, paths: list[str]) -> int:
+    """Add every player in the sports_players responses as a two-way player with fresh ratings and outcome counts
+
+        Players that already have a pitcher row are skipped, the first file listing a player wins.
+    """
+    seen = set(connection.execute(select(Pitcher.playerId)).scalars())
+    pitcher_id = next_id(connection, Pitcher.__table__)
+    batter_id = next_id(connection, Batter.__table__)
+    outcome_id = next_id(connection, PitcherOutcome.__table__)
+    # pitcher and batter ratings share one id space, like data_clean.initialize_ratings
+    rating_id = next_id(connection, PitcherRating.__table__, BatterRating.__table__)
+
+    players, pitchers, batters, outcomes, pitcher_ratings, batter_ratings = [], [], [], [], [], []
+    for path in paths:
+        for p in read_json(path)['people']:
+            if p['id'] in seen:
+                continue
+            seen.add(p['id'])
+            players.append({'id': p['id'], 'fullName': p['fullName'], 'firstName': p['firstName'], 'lastName': p['lastName'],
+                            'primaryNumber': p.get('primaryNumber') or 'NA', 'position': p['primaryPosition']['abbreviation'],
+                            'teamId': p.get('currentTeam', {}).get('id')})
+            outcomes.append({'id': outcome_id, 'pitcherId': pitcher_id, 'outs': 0, 'singles': 0, 'doubles': 0, 'triples': 0, 'home_runs': 0})
+            pitchers.append({'id': pitcher_id, 'playerId': p['id'], 'ratingId': rating_id, 'pitchHand': p.get('pitchHand', {}).get('code'),
+                             'n_plays': 0, 'outcomesId': outcome_id})
+            pitcher_ratings.append({'id': rating_id, 'pitcherId': pitcher_id, 'value': INITIAL_RATING})
+            batters.append({'id': batter_id, 'playerId': p['id'], 'ratingId': rating_id + 1, 'batSide': p.get('batSide', {}).get('code'),
+                            'n_plays': 0})
+            batter_ratings.append({'id': rating_id + 1, 'batterId': batter_id, 'value': INITIAL_RATING})
+            pitcher_id, batter_id, outcome_id, rating_id = pitcher_id + 1, batter_id + 1, outcome_id + 1, rating_id + 2
+
+    insert_or_ignore(connection, Player, players)
+    for model, rows in ((PitcherOutcome, outcomes), (Pitcher, pitchers), (Batter, batters),
+                        (PitcherRating, pitcher_ratings), (BatterRating, batter_ratings)):
+        if rows:
+            connection.execute(model.__table__.insert(), rows)
+    return len(players)
+
+
+def load_games(connection: Connection, schedule: list[dict], fetch) -> tuple[int, int]:
+    """Insert the scheduled games and their plays, checkpointing them so ingest.ingest_games skips them later"""
+    done = set(connection.execute(select(IngestCheckpoint.gameId)).scalars())
+    schedule = [g for g in unique_games(schedule) if g['game_id'] not in done]
+    checkpoints = []
+    n_plays = 0
+    for g in schedule:
+        plays = play_rows(g['game_id'], fetch(g['game_id']))
+        insert_or_ignore(connection, Game, [game_row(g)])
+        insert_or_ignore(connection, Play, plays)
+        checkpoints.append({'gameId': g['game_id'], 'nPlays': len(plays), 'finishedAt': datetime.now()})
+        n_plays += len(plays)
+    insert_or_ignore(connection, IngestCheckpoint, checkpoints)
+    return len(schedule), n_plays
+
+
+def cached_fetcher(cache: ApiCache):
+    """Play by play straight from the statsapi response cache, never touching the network"""
+    def fetch(game_id: int) -> dict:
+        return cache.load('game_playByPlay', {'gamePk': game_id})
+    return fetch
+
+
+def bulk_load(data_dir: str = DATA_DIR, schedule_path: str = None, games_path: str = None, engine: Engine = engine):
+    """Build teams, players and games from the JSON files in data_dir in a single transaction
+
+        schedule_path holds a statsapi.schedule list (or one entry, like game_info.json). Play by play is read
+        from games_path, either a directory of <game_id>.json files or one file, or from the response cache
+        when games_path is None.
+    """
+    schedule_path = schedule_path or os.path.join(data_dir, 'game_info.json')
+    schedule = read_json(schedule_path)
+    if isinstance(schedule, dict):
+        schedule = [schedule]
+    fetch = fixture_fetcher(games_path) if games_path else cached_fetcher(ApiCache(cache_only=True))
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        n_teams = load_teams(connection, os.path.join(data_dir, 'teams.json'))
+        n_players = load_players(connection, sorted(glob.glob(os.path.join(data_dir, 'players_*.json'))))
+        n_games, n_plays = load_games(connection, schedule, fetch)
+    return n_teams, n_players, n_games, n_plays
+
+
+def main():
+    # python bulk_load.py [schedule.json [games_dir_or_file]], defaults to data/game_info.json and data/sample_game.json
+    schedule_path = sys.argv[1] if len(sys.argv) > 1 else None
+    games_path = sys.argv[2] if len(sys.argv) > 2 else (None if schedule_path else os.path.join(DATA_DIR, 'sample_game.json'))
+    n_teams, n_players, n_games, n_plays = bulk_load(schedule_path=schedule_path, games_path=games_path)
+    print(f'Loaded {n_teams} teams, {n_players} players, {n_games} games and {n_plays} plays')
+
+
+if __name__ == "__main__":
+    main()
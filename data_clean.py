@@ -1,16 +1,16 @@
 import logging
-from datetime import date, datetime
+import os
 import math
 # import json
 
-from sqlalchemy import create_engine, asc
+from sqlalchemy import create_engine, asc, text, bindparam
 from sqlalchemy.orm import sessionmaker, joinedload
 from sqlalchemy.exc import IntegrityError
 
-import statsapi
-
-from models import Team, Game, Play, Player, Pitcher, Batter, Base, PitcherRating, BatterRating, PitcherOutcome
+from models import Team, Game, Play, Player, Pitcher, Batter, Base, PitcherRating, BatterRating, PitcherOutcome, Result, RAW_RESULTS
 from progressbar import progressbar
+from ingest import ingest_games
+from api_cache import ApiCache
 
 
 DB_FILE = 'data/mlb.db'
@@ -18,6 +18,9 @@ LOG_FILE = 'logs/data.log'
 
 INITIAL_RATING = 1000
 
+# raw statsapi responses are cached on disk, set STATSAPI_CACHE_ONLY=1 to rebuild without the network
+api = ApiCache(cache_only=os.environ.get('STATSAPI_CACHE_ONLY') == '1')
+
 engine = create_engine('sqlite:///' + DB_FILE, echo=False)
 Session = sessionmaker(bind=engine)
 session = Session()
@@ -33,7 +36,7 @@ logger.addHandler(handler)
 def read_all_players(seasons):
     print('Loading players...')
     for season in seasons:
-        players = statsapi.get('sports_players', {'sportId': 1, 'season': season})['people']
+        players = api.get('sports_players', {'sportId': 1, 'season': season})['people']
         for p in progressbar(players):
             if not p.get('primaryNumber'):
                 p['primaryNumber'] = 'NA'
@@ -56,7 +59,7 @@ def read_all_players(seasons):
 
 
 def read_all_teams():
-    teams = statsapi.get('teams', {'sportId': 1})['teams']   
+    teams = api.get('teams', {'sportId': 1})['teams']   
     for t in teams:
         new_team = Team(id=t['id'], name=t['name'], abbreviation=t['abbreviation'], locationName=t['locationName'])
         session.add(new_team)
@@ -67,35 +70,18 @@ def read_all_teams():
             logger.warning('Team {} already exists'.format(t['id']))
 
 
+def fetch_play_by_play(game_id: int) -> dict:
+    return api.get('game_playByPlay', {'gamePk': game_id})
+
+
 def read_all_games():
-    last_day_21 = date(2021, 10, 3)
     print('Retrieving schedule...')
-    games = statsapi.schedule(start_date='04/01/2021', end_date='10/03/2021', sportId=1)
-    games += statsapi.schedule(start_date='04/07/2022', end_date='10/02/2022', sportId=1)
+    games = api.schedule(start_date='04/01/2021', end_date='10/03/2021', sportId=1)
+    games += api.schedule(start_date='04/07/2022', end_date='10/02/2022', sportId=1)
     print('Schedule received.')
-    print('Loading games...')
-    for g in progressbar(games):
-        # read the game date as a DateTime object
-        g['game_date'] = date.fromisoformat(g['game_date'])
-        szn = 2021 if g['game_date'] <= last_day_21 else 2022
-        new_game = Game(id=g['game_id'], date=g['game_date'], homeTeamId=g['home_id'], awayTeamId=g['away_id'], venue=g['venue_name'], szn=szn)
-        session.add(new_game)
-        try:
-            session.commit()
-        except IntegrityError:
-            session.rollback()
-            logger.warning('Game {} already exists'.format(g['game_id']))
-            continue
-        # get play by play for the game
-        plays = statsapi.get('game_playByPlay', {'gamePk': g['game_id']})['allPlays']
-        for p in plays:
-            new_play = Play(gameId=g['game_id'], result=p['result']['event'], pitcherId=p['matchup']['pitcher']['id'], batterId=p['matchup']['batter']['id'], game=new_game, atBatIndex=p['about']['atBatIndex'], inning=p['about']['inning'], outs=p['count']['outs'], runnersOn=len(p['runners'])-1)
-            session.add(new_play)
-            try:
-                session.commit()
-            except IntegrityError:
-                session.rollback()
-                logger.warning('Play already exists for game {}'.format(g['game_id']))
+    # play by play is fetched concurrently and checkpointed per game, so an interrupted run resumes
+    n_games, n_plays = ingest_games(games, fetch=fetch_play_by_play, engine=engine)
+    print(f'Loaded {n_games} games and {n_plays} plays.')
 
 def initialize_outcomes():
     pitchers = session.query(Pitcher).all()
@@ -142,64 +128,30 @@ def initialize_ratings():
         i += 1
 
 def get_number_of_games():
-    print('Updating n_games for each pitcher...')
-    # get all of the pitchers
-    pitchers = session.query(Pitcher).all()
-    for pitcher in progressbar(pitchers):
-        # get the number of games for each pitcer
-        count = session.query(Play).filter(Play.pitcherId == pitcher.playerId).count()
-        pitcher.n_plays = count
-        session.commit()
-    
-    # get all of the batters
-    batters = session.query(Batter).all()
-    print('Updating n_games for each batter...')
-    for batter in progressbar(batters):
-        # get the number of games for each batter
-        count = session.query(Play).filter(Play.batterId == batter.playerId).count()
-        batter.n_plays = count
-        session.commit()
+    # one GROUP BY per position and one executemany UPDATE, all in a single transaction
+    for players, column in (('pitchers', 'pitcherId'), ('batters', 'batterId')):
+        print(f'Updating n_plays for {players}...')
+        counts = session.execute(text(f'SELECT "{column}", COUNT(*) FROM plays GROUP BY "{column}"')).fetchall()
+        session.execute(text(f'UPDATE {players} SET n_plays = 0'))
+        if counts:
+            session.execute(text(f'UPDATE {players} SET n_plays = :n_plays WHERE "playerId" = :player_id'),
+                            [{'player_id': player_id, 'n_plays': n_plays} for player_id, n_plays in counts])
+    session.commit()
 
-def clean_play_outcomes():
-    all_plays = session.query(Play).all()
+# canonical result label -> raw statsapi event names folded into it
+RESULT_CLEANING = {result.label: raw_results for result, raw_results in RAW_RESULTS.items()}
 
-    bunt_outs = {'Bunt Groundout', 'Bunt Pop Out', 'Bunt Lineout', 'Bunt Flyout',\
-                 'Bunt Forceout', 'Bunt Double Play', 'Bunt Grounded Into DP', 'Bunt Out'}
-    
-    caught_steals = {'Caught Stealing', 'Caught Stealing 2B', 'Caught Stealing 3B', 'Caught Stealing Home',\
-                     'Caught Stealing 2B CS', 'Caught Stealing 3B CS', 'Caught Stealing Home CS'}
-    
-    pickoffs = {'Pickoff', 'Pickoff 1B', 'Pickoff 2B', 'Pickoff 3B', 'Pickoff Caught Stealing 2B',\
-                'Pickoff Caught Stealing 3B', 'Pickoff Caught Stealing Home', 'Stolen Base 2B'}
-
-    outs = {'Field Error', 'Field Out', 'Fielders Choice', 'Fielders Choice Out',\
-            'Double Play', 'Forceout', 'Game Advisory', 'Grounded Into DP', 'Groundout',\
-            'Lineout', 'Pop Out', 'Runner Out', 'Strikeout', 'Strikeout Double Play', 'Triple Play', 'Batter Out', 'Flyout',\
-            'Sac Bunt', 'Sac Fly', 'Sac Fly Double Play', 'Sac Bunt Double Play'}
-    
-    walks_or_eq = {'Wild Pitch', 'Passed Ball', 'Intent Walk', 'Hit By Pitch', 'Balk', 'Catcher Interference'}
+def clean_play_outcomes():
+    """Fold raw event names into canonical results with one UPDATE per result, then store each result's integer code"""
     print('Cleaning play outcomes...')
-    i = 0
-    updates = {
-        'Bunt Out': 0,
-        'Pickoff': 0,
-        'Out': 0,
-        'Walk': 0,
-        'DNS': 0,
-    }
-    for play in progressbar(all_plays):
-        if play.result in caught_steals or play.result in pickoffs:
-            play.result = 'DNS'
-            updates['DNS'] += 1
-        elif play.result in outs or play.result in bunt_outs:
-            play.result = 'Out'
-            updates['Out'] += 1
-        elif play.result in walks_or_eq:
-            play.result = 'Walk'
-            updates['Walk'] += 1
-        if i+1 % 100 == 0:
-            session.commit()
-        i += 1
+    updates = {}
+    for result, raw_results in RESULT_CLEANING.items():
+        statement = text('UPDATE plays SET result = :result WHERE result IN :raw_results').bindparams(bindparam('raw_results', expanding=True))
+        updates[result] = session.execute(statement, {'result': result, 'raw_results': sorted(raw_results)}).rowcount
+
+    # results that are not canonical yet get no code and are rejected by play_store.check_result_codes
+    cases = ' '.join(f"WHEN '{result.label}' THEN {result.value}" for result in Result)
+    session.execute(text(f'UPDATE plays SET "resultCode" = CASE result {cases} END'))
     session.commit()
     print(updates)
         
@@ -244,16 +196,21 @@ def assign_training_data():
     session.commit()
 
 def assign_outcomes():
-    pitchers = session.query(Pitcher).all()
-
-    for pitcher in progressbar(pitchers):
-        pitcher.outcomes.outs = session.query(Play).filter(Play.pitcherId == pitcher.playerId, Play.result == 'Out').count()
-        pitcher.outcomes.singles = session.query(Play).filter(Play.pitcherId == pitcher.playerId, Play.result == 'Single').count()
-        pitcher.outcomes.doubles = session.query(Play).filter(Play.pitcherId == pitcher.playerId, Play.result == 'Double').count()
-        pitcher.outcomes.triples = session.query(Play).filter(Play.pitcherId == pitcher.playerId, Play.result == 'Triple').count()
-        pitcher.outcomes.home_runs = session.query(Play).filter(Play.pitcherId == pitcher.playerId, Play.result == 'Home Run').count()
-        session.add(pitcher)
-        session.commit()
+    print('Counting pitcher outcomes...')
+    # Result -> pitcher_outcomes column, e.g. Result.HOME_RUN -> 'home_runs'
+    outcome_columns = PitcherOutcome.result_columns
+
+    sums = ', '.join(f'SUM("resultCode" = {result.value})' for result in outcome_columns)
+    counts = session.execute(text(f'SELECT "pitcherId", {sums} FROM plays GROUP BY "pitcherId"')).fetchall()
+
+    session.execute(text('UPDATE pitcher_outcomes SET ' + ', '.join(f'{column} = 0' for column in outcome_columns.values())))
+    if counts:
+        assignments = ', '.join(f'{column} = :{column}' for column in outcome_columns.values())
+        session.execute(
+            text(f'UPDATE pitcher_outcomes SET {assignments} WHERE id = (SELECT "outcomesId" FROM pitchers WHERE "playerId" = :player_id)'),
+            [{'player_id': row[0], **dict(zip(outcome_columns.values(), row[1:]))} for row in counts]
+        )
+    session.commit()
 
 def main():
     Base.metadata.create_all(engine)
@@ -1,7 +1,9 @@
 from contextlib import contextmanager
-from sqlalchemy import create_engine
+from datetime import date, datetime
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import Session, sessionmaker, joinedload
-from models import engine, Game, Play, Position, Pitcher, Batter
+from models import engine, Game, Play, Position, Pitcher, Batter, PitcherOutcome, RatingSnapshot
+from play_store import PlayRow, BATCH_SIZE, stream_play_rows, check_result_codes
 
 @contextmanager
 def create_session_scope(existing_session=None):
@@ -39,6 +41,18 @@ def get_all_plays(session: Session, training: bool = True) -> list[Play]:
     #     plays = [play for game in games for play in game.plays if play.pitcher.n_plays > 600 and play.batter.n_plays > 600]
     return plays
 
+def iter_plays(session: Session, training: bool = True, batch_size: int = BATCH_SIZE):
+    """Stream plays as PlayRow tuples in chronological (date, gameId, atBatIndex) order
+
+        Unlike get_all_plays only batch_size rows are held at once, no ORM objects are built.
+    """
+    for rows in stream_play_rows(session, training, batch_size):
+        check_result_codes([row[4] for row in rows])
+        for row in rows:
+            # SQLite hands back dates from a text query as ISO strings
+            game_date = date.fromisoformat(row[1]) if isinstance(row[1], str) else row[1]
+            yield PlayRow(row[0], game_date, *row[2:])
+
 
 def get_n_plays(id: int, position: Position, session: Session):
     if position == Position.PITCHER:
@@ -60,4 +74,59 @@ def get_n_plays(id: int, position: Position, session: Session):
     except UnboundLocalError:
         raise Exception(
             f"Position must be either {Position.PITCHER} or {Position.BATTER}"
-        )
\ No newline at end of file
+        )
+
+RATING_TABLES = ['pitcher_ratings', 'batter_ratings'] # lines up with Position enum
+
+def bulk_update_ratings(session: Session, position: Position, rating_ids, values):
+    """Write rating values back with a single executemany UPDATE, the caller owns the transaction"""
+    params = [{'id': rating_id, 'value': value} for rating_id, value in zip(rating_ids, values)]
+    if params:
+        session.execute(text(f"UPDATE {RATING_TABLES[position.value]} SET value = :value WHERE id = :id"), params)
+    return len(params)
+
+PLAYER_TABLES = ['pitchers', 'batters'] # lines up with Position enum
+
+def get_player_ratings(session: Session, position: Position):
+    """(playerId, ratingId, value) for every player at a position in one query, ordered by playerId"""
+    players, ratings = PLAYER_TABLES[position.value], RATING_TABLES[position.value]
+    return session.execute(text(
+        f'SELECT {players}."playerId", {players}."ratingId", {ratings}.value FROM {players} '
+        f'JOIN {ratings} ON {ratings}.id = {players}."ratingId" ORDER BY {players}."playerId"'
+    )).fetchall()
+
+def get_pitcher_outcome_counts(session: Session):
+    """(playerId, n_plays, outs, singles, doubles, triples, home_runs) for every pitcher in one query, ordered by playerId"""
+    columns = ', '.join(f'COALESCE(pitcher_outcomes.{column}, 0)' for column in PitcherOutcome.outcome_columns.values())
+    return session.execute(text(
+        f'SELECT pitchers."playerId", COALESCE(pitchers.n_plays, 0), {columns} FROM pitchers '
+        f'LEFT JOIN pitcher_outcomes ON pitcher_outcomes.id = pitchers."outcomesId" ORDER BY pitchers."playerId"'
+    )).fetchall()
+
+HAND_COLUMNS = ['pitchHand', 'batSide'] # lines up with Position enum
+
+def get_player_hands(session: Session, position: Position):
+    """(playerId, hand) for every player at a position in one query, ordered by playerId
+
+        hand is pitchHand for pitchers and batSide for batters
+    """
+    players = PLAYER_TABLES[position.value]
+    return session.execute(text(
+        f'SELECT "playerId", "{HAND_COLUMNS[position.value]}" FROM {players} ORDER BY "playerId"'
+    )).fetchall()
+
+def save_rating_snapshot(session: Session, model: str, version: int, data: bytes) -> int:
+    snapshot = RatingSnapshot(model=model, version=version, createdAt=datetime.now(), data=data)
+    session.add(snapshot)
+    session.commit()
+    return snapshot.id
+
+def load_rating_snapshot(session: Session, snapshot_id: int = None):
+    """Raw (id, version, data) of a rating snapshot, the most recent one if no id is given"""
+    if snapshot_id is None:
+        row = session.execute(text("SELECT id, version, data FROM rating_snapshots ORDER BY id DESC LIMIT 1")).first()
+    else:
+        row = session.execute(text("SELECT id, version, data FROM rating_snapshots WHERE id = :id"), {'id': snapshot_id}).first()
+    if row is None:
+        raise LookupError(f"No rating snapshot {'found' if snapshot_id is None else snapshot_id}")
+    return row
@@ -0,0 +1,154 @@
+import numpy as np
+
+from models import Position
+from utils import SIGMA, calculate_xp
+
+
+def expected_scores(batter_ratings, pitcher_ratings, sigma=SIGMA):
+    """Vectorized utils.calculate_ev: the batter's expected score against the pitcher"""
+    return 1 / (1 + 10 ** ((pitcher_ratings - batter_ratings) / sigma))
+
+
+def player_indices(player_ids: np.ndarray, ids, missing: int = None) -> np.ndarray:
+    """Map ids to their positions in the sorted array player_ids
+
+        Ids that are not in player_ids raise KeyError, or map to missing when it is given.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(player_ids):
+        if missing is None and len(ids):
+            raise KeyError(f"Unknown player ids: {np.unique(ids)[:10].tolist()}")
+        return np.full(len(ids), missing if missing is not None else 0, dtype=np.int64)
+    first_id = int(player_ids[0])
+    span = int(player_ids[-1]) - first_id + 1
+    if span <= 4 * (len(ids) + len(player_ids)):
+        # ids are dense enough for a table indexed by id, one gather instead of a binary search per id
+        table = np.full(span, -1, dtype=np.int64)
+        table[player_ids - first_id] = np.arange(len(player_ids))
+        offsets = ids - first_id
+        inside = (offsets >= 0) & (offsets < span)
+        indices = np.full(len(ids), -1, dtype=np.int64)
+        indices[inside] = table[offsets[inside]]
+        unknown = indices == -1
+    else:
+        indices = np.searchsorted(player_ids, ids)
+        indices[indices == len(player_ids)] = 0
+        unknown = player_ids[indices] != ids
+    if unknown.any():
+        if missing is None:
+            raise KeyError(f"Unknown player ids: {np.unique(ids[unknown])[:10].tolist()}")
+        indices[unknown] = missing
+    return indices
+
+
+def position_indices(player_ids: list[np.ndarray], pitcher_ids, batter_ids):
+    """player_indices of pitchers and batters in per-position id arrays (lines up with Position enum)"""
+    return (player_indices(player_ids[Position.PITCHER.value], pitcher_ids),
+            player_indices(player_ids[Position.BATTER.value], batter_ids))
+
+
+def latest_previous_games(pitcher_index: np.ndarray, batter_index: np.ndarray, game_bounds: np.ndarray) -> np.ndarray:
+    """For every game, the latest earlier game any of its players appeared in, -1 if none of them had played"""
+    n_games, n_plays = len(game_bounds) - 1, len(pitcher_index)
+    latest = np.full(n_games, -1, dtype=np.int64)
+    if not n_plays:
+        return latest
+    # pitchers and batters as one key space, so a single sort covers both
+    players = np.concatenate((pitcher_index, batter_index + (int(pitcher_index.max()) + 1)))
+    if players.max() < 2 ** 16:
+        # a stable sort of 16 bit keys is a radix sort, far quicker than sorting int64s
+        players = players.astype(np.uint16)
+    games = np.tile(np.repeat(np.arange(n_games, dtype=np.int32), np.diff(game_bounds)), 2)
+    order = np.argsort(players, kind='stable')
+    players, games = players[order], games[order]
+    # plays stay in game order within each player's run, so wherever a player moves on to a new game
+    # the play before it is from the last game they were in
+    moves = np.flatnonzero((players[1:] == players[:-1]) & (games[1:] != games[:-1])) + 1
+    previous = np.full(2 * n_plays, -1, dtype=np.int32)
+    previous[order[moves]] = games[moves - 1]
+    # back in play order, each half runs game by game
+    played = np.diff(game_bounds) > 0
+    starts = game_bounds[:-1][played]
+    latest[played] = np.maximum(np.maximum.reduceat(previous[:n_plays], starts), np.maximum.reduceat(previous[n_plays:], starts))
+    return latest
+
+
+def independent_blocks(pitcher_index: np.ndarray, batter_index: np.ndarray, game_bounds: np.ndarray) -> np.ndarray:
+    """Merge consecutive games that share no player into blocks, returned as bounds like game_bounds
+
+        No game in a block reads a rating another game in it writes, so updating a whole block at once
+        gives the per-game result. With one game per team and day most days are a single block.
+        Compute the blocks once and pass them to simulate_games on every pass over the same plays.
+    """
+    game_bounds = np.asarray(game_bounds)
+    n_games = len(game_bounds) - 1
+    if n_games < 2:
+        return game_bounds
+    latest = latest_previous_games(pitcher_index, batter_index, game_bounds)
+    # a block that starts at game b ends before the first later game with a player who has played since b
+    block_starts = [0]
+    window = 64
+    while True:
+        start = block_starts[-1]
+        clashes = np.flatnonzero(latest[start + 1:start + 1 + window] >= start)
+        if len(clashes):
+            block_starts.append(start + 1 + int(clashes[0]))
+        elif start + 1 + window >= n_games:
+            break
+        else:
+            window *= 2
+    return np.append(game_bounds[block_starts], game_bounds[-1])
+
+
+def simulate_games(pitcher_ratings: np.ndarray, batter_ratings: np.ndarray,
+                   pitcher_index: np.ndarray, batter_index: np.ndarray, scores: np.ndarray,
+                   block_bounds: np.ndarray, K: float, sigma: float = SIGMA,
+                   pitcher_n_plays: np.ndarray = None, batter_n_plays: np.ndarray = None):
+    """Run the per-game Elo update over a chronological block of plays, updating the ratings in place.
+
+        Every play in a game is scored against the ratings the players had at the start of the game,
+        then each player's rating moves by K * (scored - expected) summed over their plays in that game.
+        Block i spans plays [block_bounds[i], block_bounds[i+1]) and holds either one game, as from
+        PlayStore.game_bounds, or games that share no player, as from independent_blocks.
+
+        If play count arrays are given, they are updated in place and each change is scaled by the
+        utils.calculate_xp experience factor of the player's count at the end of the game.
+    """
+    n_pitchers, n_batters = len(pitcher_ratings), len(batter_ratings)
+    for start, end in zip(block_bounds[:-1].tolist(), block_bounds[1:].tolist()):
+        pitchers = pitcher_index[start:end]
+        batters = batter_index[start:end]
+        e_b = expected_scores(batter_ratings[batters], pitcher_ratings[pitchers], sigma)
+        change = K * (scores[start:end] - e_b)
+        if pitcher_n_plays is not None:
+            pitcher_n_plays += np.bincount(pitchers, minlength=n_pitchers)
+            batter_n_plays += np.bincount(batters, minlength=n_batters)
+            batter_ratings += np.bincount(batters, change * calculate_xp(batter_n_plays[batters]), minlength=n_batters)
+            pitcher_ratings -= np.bincount(pitchers, change * calculate_xp(pitcher_n_plays[pitchers]), minlength=n_pitchers)
+        else:
+            batter_ratings += np.bincount(batters, change, minlength=n_batters)
+            # the pitcher scores 1 - s_b against an expectation of 1 - e_b
+            pitcher_ratings -= np.bincount(pitchers, change, minlength=n_pitchers)
+
+
+def replay_plays(pitcher_ratings: np.ndarray, batter_ratings: np.ndarray,
+                 pitcher_index: np.ndarray, batter_index: np.ndarray, scores: np.ndarray,
+                 K: float, sigma: float = SIGMA) -> np.ndarray:
+    """Predict each play and then apply the per-play Elo update, updating the ratings in place.
+
+        returns: the batter's expected score for every play, taken before that play's update
+    """
+    pitcher_values = pitcher_ratings.tolist()
+    batter_values = batter_ratings.tolist()
+    expected = np.empty(len(scores))
+    for i, (pitcher, batter, s_b) in enumerate(zip(pitcher_index.tolist(), batter_index.tolist(), scores.tolist())):
+        e_b = 1 / (1 + 10 ** ((pitcher_values[pitcher] - batter_values[batter]) / sigma))
+        expected[i] = e_b
+        if s_b == -1:
+            continue
+        change = K * (s_b - e_b)
+        batter_values[batter] += change
+        pitcher_values[pitcher] -= change
+    pitcher_ratings[:] = pitcher_values
+    batter_ratings[:] = batter_values
+    return expected
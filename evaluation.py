@@ -0,0 +1,119 @@
+import json
+
+import numpy as np
+
+from play_store import PlayStore, RESULTS
+from prediction_model import PredictionModel, results_table, partial_results_table
+
+
+def score_lookup(table: dict) -> np.ndarray:
+    """Observed score of each result code, results missing from the table are not scored (-1)"""
+    return np.array([table.get(result, -1) for result in RESULTS], dtype=np.float64)
+
+
+# columns of play_terms and metric_totals
+TERMS = ('n_plays', 'observed', 'expected', 'wrong', 'n_partial_plays', 'partial_observed', 'partial_expected',
+         'partial_wrong', 'crossentropy')
+
+
+def normalize_outcomes(outcomes: np.ndarray) -> np.ndarray:
+    """Outcome probability rows rescaled to sum to one, as log_loss did before scoring them, the models' rows need not"""
+    outcomes = np.asarray(outcomes, dtype=np.float64)
+    sums = outcomes.sum(axis=-1, keepdims=True)
+    return outcomes / np.where(sums > 0, sums, 1)
+
+
+def partial_labels(plays: PlayStore, partial_results_table=partial_results_table) -> np.ndarray:
+    """Class of each play's partial result, its position in partial_results_table, the mapping log_loss is given"""
+    value_to_index = {value: i for i, value in enumerate(partial_results_table.values()) if value != -1}
+    partial_observed = score_lookup(partial_results_table)[plays.result]
+    return np.array([value_to_index.get(value, 0) for value in partial_observed.tolist()], dtype=np.int64)
+
+
+def play_terms(plays: PlayStore, hit: np.ndarray, partial: np.ndarray, outcomes: np.ndarray,
+               results_table=results_table, partial_results_table=partial_results_table) -> np.ndarray:
+    """Each play's contribution to the totals behind every metric, an (N x len(TERMS)) matrix
+
+        Plays a table does not score contribute zeros to that table's terms.
+    """
+    observed = score_lookup(results_table)[plays.result]
+    scored = observed != -1
+    partial_observed = score_lookup(partial_results_table)[plays.result]
+    partial_scored = partial_observed != -1
+
+    labels = partial_labels(plays, partial_results_table)
+    # renormalized and then clipped like log_loss
+    eps = np.finfo(np.float64).eps
+    true_probs = np.clip(normalize_outcomes(outcomes)[np.arange(len(labels)), labels], eps, 1 - eps) if len(labels) else np.zeros(0)
+
+    terms = np.zeros((len(plays), len(TERMS)))
+    terms[:, 0] = scored
+    terms[:, 1] = np.where(scored, observed, 0)
+    terms[:, 2] = np.where(scored, hit, 0)
+    terms[:, 3] = scored & (observed != (hit > 0.5))
+    terms[:, 4] = partial_scored
+    terms[:, 5] = np.where(partial_scored, partial_observed, 0)
+    terms[:, 6] = np.where(partial_scored, partial, 0)
+    terms[:, 7] = partial_scored & (partial_observed != partial)
+    terms[:, 8] = np.where(partial_scored, -np.log(true_probs), 0)
+    return terms
+
+
+def metric_totals(plays: PlayStore, hit: np.ndarray, partial: np.ndarray, outcomes: np.ndarray,
+                  results_table=results_table, partial_results_table=partial_results_table) -> np.ndarray:
+    """Additive totals behind every metric (see TERMS), so that totals from consecutive chunks of a split can be summed"""
+    return play_terms(plays, hit, partial, outcomes, results_table, partial_results_table).sum(axis=0)
+
+
+def metrics_from_totals(totals: np.ndarray) -> dict:
+    """Metrics from one row of totals, or arrays of metrics from an (n x len(TERMS)) matrix of them"""
+    n_plays, observed, expected, wrong, n_partial_plays, partial_observed, partial_expected, partial_wrong, crossentropy = np.moveaxis(totals, -1, 0)
+    metrics = {
+        'n_plays': n_plays,
+        'long_term_inaccuracy': np.abs(observed - expected) / n_plays,
+        'pbp_inaccuracy': wrong / n_plays,
+        'n_partial_plays': n_partial_plays,
+        'partial_long_term_inaccuracy': np.abs(partial_observed - partial_expected) / n_partial_plays,
+        'partial_pbp_inaccuracy': partial_wrong / n_partial_plays,
+        'categorical_crossentropy': crossentropy / n_partial_plays,
+    }
+    if np.ndim(totals) == 1:
+        return {name: int(value) if name.startswith('n_') else float(value) for name, value in metrics.items()}
+    return metrics
+
+
+def compute_metrics(plays: PlayStore, hit: np.ndarray, partial: np.ndarray, outcomes: np.ndarray,
+                    results_table=results_table, partial_results_table=partial_results_table) -> dict:
+    """Every test_performance metric computed from per-play predictions in one pass over the arrays"""
+    return metrics_from_totals(metric_totals(plays, hit, partial, outcomes, results_table, partial_results_table))
+
+
+def evaluate(model: PredictionModel, plays, results_table=results_table, partial_results_table=partial_results_table) -> dict:
+    """Replay the test plays once on a copy of the model and compute every metric from that single pass
+
+        plays is a PlayStore or an iterable of consecutive chunks (play_store.iter_play_stores), which are
+        replayed in order on the same copy so only one chunk of predictions is held at a time
+    """
+    chunks = [plays] if isinstance(plays, PlayStore) else plays
+    model = model.copy()
+    totals = np.zeros(len(TERMS))
+    for chunk in chunks:
+        hit, partial, outcomes = model.replay_many(chunk)
+        totals += metric_totals(chunk, hit, partial, outcomes, results_table, partial_results_table)
+    return metrics_from_totals(totals)
+
+
+def evaluate_models(models: dict, plays: PlayStore, results_table=results_table, partial_results_table=partial_results_table) -> dict:
+    """Evaluate every named model against the same plays, returns a JSON-serializable report"""
+    return {
+        'n_test_plays': len(plays),
+        'models': {name: evaluate(model, plays, results_table, partial_results_table) for name, model in models.items()},
+    }
+
+
+def write_report(report: dict, path: str = None):
+    if path is None:
+        print(json.dumps(report, indent=4))
+    else:
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,118 @@
+import numpy as np
+from sqlalchemy.orm import Session
+
+from db_utils import get_player_hands
+from elo_engine import player_indices
+from models import Position
+from play_store import PlayStore
+from rating_history import RatingHistory
+
+# every feature FeatureBuilder knows, in the column order of the design matrix
+FEATURES = ('inning', 'outs_before', 'runners_before', 'pitcher_rating', 'batter_rating', 'pitcher_left', 'batter_left',
+            'batter_switch', 'same_side', 'batter_home')
+# everything that needs nothing but the database
+CONTEXT_FEATURES = ('inning', 'outs_before', 'runners_before', 'pitcher_left', 'batter_left', 'batter_switch', 'same_side', 'batter_home')
+
+
+def sorted_lookup(keys: np.ndarray, values: np.ndarray, ids, missing):
+    """values of each id in the sorted array keys, ids that are not in keys get missing"""
+    return np.append(values, np.array([missing], dtype=values.dtype))[player_indices(keys, ids, missing=len(keys))]
+
+
+def inning_starts(plays: PlayStore) -> np.ndarray:
+    """True for the first play of every game and inning"""
+    starts = np.ones(len(plays), dtype=bool)
+    starts[1:] = (plays.gameId[1:] != plays.gameId[:-1]) | (plays.inning[1:] != plays.inning[:-1])
+    return starts
+
+
+def half_inning_starts(plays: PlayStore) -> np.ndarray:
+    """True for the first play of every half inning: the first play of a game or inning, or the play after a third out"""
+    starts = inning_starts(plays)
+    starts[1:] |= plays.outs[:-1] >= 3
+    return starts
+
+
+def state_before(plays: PlayStore, column: np.ndarray) -> np.ndarray:
+    """The value a play-end column held when each play started
+
+        outs and runnersOn are recorded at the end of each play, so the outs after an out play already
+        count it. A play starts from the previous play's value, or from 0 when it opens a half inning.
+    """
+    before = np.zeros(len(plays), dtype=np.int64)
+    if len(plays) > 1:
+        continues = ~half_inning_starts(plays)[1:] & (column[:-1] >= 0)
+        before[1:] = np.where(continues, column[:-1], 0)
+    return before
+
+
+def bottom_of_inning(plays: PlayStore) -> np.ndarray:
+    """True for plays in the bottom half of their inning, where the home team bats
+
+        Counts the half innings begun since the inning's first play, so each inning corrects any
+        boundary the one before it missed.
+    """
+    started = np.cumsum(half_inning_starts(plays))
+    inning_first = np.maximum.accumulate(np.where(inning_starts(plays), np.arange(len(plays)), 0))
+    return started - started[inning_first] >= 1
+
+
+class FeatureBuilder:
+    """Assembles per-play design matrices from a PlayStore in bulk
+
+        Player handedness is read once into sorted arrays, after which any set of FEATURES for any
+        number of plays is a handful of array lookups. Ratings come from a RatingHistory recorded
+        while training (EloModel.record_history): each play sees the ratings from before its date,
+        so no play's own outcome is in its features. The builder holds no session, so models using
+        it can be copied and sent to other processes.
+    """
+
+    def __init__(self, session: Session, history: RatingHistory = None):
+        self.player_ids, self.hands = [], []
+        for position in Position:
+            rows = get_player_hands(session, position)
+            self.player_ids.append(np.array([row[0] for row in rows], dtype=np.int64))
+            self.hands.append(np.array([row[1] or '' for row in rows], dtype='U1'))
+        self.history = history
+
+    def hand(self, position: Position, ids) -> np.ndarray:
+        return sorted_lookup(self.player_ids[position.value], self.hands[position.value], ids, '')
+
+    def ratings(self, plays: PlayStore) -> list[np.ndarray]:
+        """Pitcher and batter ratings of every play as of the day before it (lines up with Position enum)"""
+        if self.history is None:
+            raise ValueError("Rating features need a FeatureBuilder with a rating history")
+        return self.history.ratings_before(plays.date, [plays.pitcherId, plays.batterId])
+
+    def feature(self, name: str, plays: PlayStore) -> np.ndarray:
+        if name == 'inning':
+            # extra innings play like the ninth
+            return np.clip(plays.inning, 0, 9)
+        if name == 'outs_before':
+            return state_before(plays, plays.outs)
+        if name == 'runners_before':
+            return state_before(plays, plays.runnersOn)
+        if name == 'pitcher_rating':
+            return self.ratings(plays)[Position.PITCHER.value]
+        if name == 'batter_rating':
+            return self.ratings(plays)[Position.BATTER.value]
+        if name == 'pitcher_left':
+            return self.hand(Position.PITCHER, plays.pitcherId) == 'L'
+        if name == 'batter_left':
+            return self.hand(Position.BATTER, plays.batterId) == 'L'
+        if name == 'batter_switch':
+            return self.hand(Position.BATTER, plays.batterId) == 'S'
+        if name == 'same_side':
+            # a switch hitter always takes the opposite side, so only L against L and R against R count
+            pitcher_hand = self.hand(Position.PITCHER, plays.pitcherId)
+            return (pitcher_hand != '') & (pitcher_hand == self.hand(Position.BATTER, plays.batterId))
+        if name == 'batter_home':
+            return bottom_of_inning(plays)
+        raise KeyError(f"Unknown feature: {name} (known features are: {', '.join(FEATURES)})")
+
+    def build(self, plays: PlayStore, features=CONTEXT_FEATURES) -> np.ndarray:
+        """A C-contiguous float64 design matrix with one row per play and one column per feature"""
+        matrix = np.empty((len(plays), len(features)))
+        for column, name in enumerate(features):
+            matrix[:, column] = self.feature(name, plays)
+        return matrix
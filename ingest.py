@@ -0,0 +1,142 @@
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date, datetime
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+
+from models import engine, Game, Play, IngestCheckpoint, result_code
+from progressbar import progressbar
+
+MAX_WORKERS = 8
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_play_by_play(game_id: int) -> dict:
+    import statsapi
+    return statsapi.get('game_playByPlay', {'gamePk': game_id})
+
+
+def fixture_fetcher(path: str):
+    """Offline stand-in for fetch_play_by_play
+
+        Serves <path>/<game_id>.json if path is a directory, or the same file (e.g. data/sample_game.json)
+        for every game if path is a file.
+    """
+    def fetch(game_id: int) -> dict:
+        file = os.path.join(path, f'{game_id}.json') if os.path.isdir(path) else path
+        with open(file) as f:
+            return json.load(f)
+    return fetch
+
+
+def game_row(g: dict) -> dict:
+    """Games row for a statsapi.schedule entry"""
+    game_date = date.fromisoformat(g['game_date'])
+    # a season never crosses a calendar year
+    return {'id': g['game_id'], 'date': game_date, 'homeTeamId': g['home_id'], 'awayTeamId': g['away_id'],
+            'venue': g['venue_name'], 'szn': game_date.year}
+
+
+def play_rows(game_id: int, play_by_play: dict) -> list[dict]:
+    """Plays rows for a game_playByPlay response, the raw event is kept in result and its Result code in resultCode"""
+    return [
+        {'gameId': game_id, 'result': p['result']['event'], 'resultCode': result_code(p['result']['event']), 'pitcherId': p['matchup']['pitcher']['id'],
+         'batterId': p['matchup']['batter']['id'], 'atBatIndex': p['about']['atBatIndex'], 'inning': p['about']['inning'],
+         'outs': p['count']['outs'], 'runnersOn': len(p['runners']) - 1}
+        for p in play_by_play['allPlays']
+    ]
+
+
+def write_game(engine: Engine, g: dict, play_by_play: dict) -> int:
+    """Insert a game, all of its plays and its checkpoint in one transaction"""
+    plays = play_rows(g['game_id'], play_by_play)
+    with engine.begin() as connection:
+        connection.execute(Game.__table__.insert().prefix_with('OR IGNORE'), [game_row(g)])
+        if plays:
+            connection.execute(Play.__table__.insert().prefix_with('OR IGNORE'), plays)
+        connection.execute(IngestCheckpoint.__table__.insert().prefix_with('OR IGNORE'),
+                           [{'gameId': g['game_id'], 'nPlays': len(plays), 'finishedAt': datetime.now()}])
+    return len(plays)
+
+
+def unique_games(schedule: list[dict]) -> list[dict]:
+    """The schedule with every game_id once, keeping its first entry
+
+        statsapi.schedule lists a suspended game again on the date it is resumed, under the same game_id.
+    """
+    seen = set()
+    games = []
+    for g in schedule:
+        if g['game_id'] in seen:
+            logger.warning('Skipping repeated schedule entry for game {} on {}'.format(g['game_id'], g.get('game_date')))
+            continue
+        seen.add(g['game_id'])
+        games.append(g)
+    return games
+
+
+def finished_games(engine: Engine) -> set[int]:
+    with engine.connect() as connection:
+        return set(connection.execute(select(IngestCheckpoint.gameId)).scalars())
+
+
+def fetch_completed(schedule: list[dict], fetch, max_workers: int):
+    """Yield (game, play_by_play) as fetches finish, never holding more than 2 * max_workers responses"""
+    pending = iter(schedule)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = {}
+        for g in pending:
+            in_flight[pool.submit(fetch, g['game_id'])] = g
+            if len(in_flight) < 2 * max_workers:
+                continue
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future
+        for future in list(in_flight):
+            yield in_flight.pop(future), future
+
+
+def ingest_games(schedule: list[dict], fetch=fetch_play_by_play, max_workers: int = MAX_WORKERS, engine: Engine = engine,
+                 suppress_output=False) -> tuple[int, int]:
+    """Fetch play-by-play concurrently and write each game from this thread, skipping checkpointed games
+
+        A failed fetch is logged and left without a checkpoint, so rerunning picks it up again.
+        returns: (n_games_written, n_plays_written)
+    """
+    done = finished_games(engine)
+    schedule = [g for g in unique_games(schedule) if g['game_id'] not in done]
+    completed = fetch_completed(schedule, fetch, max_workers)
+    if not suppress_output:
+        print(f'Loading {len(schedule)} games ({len(done)} already loaded)...')
+    if not suppress_output and schedule:
+        completed = progressbar(completed, len_estimate=len(schedule))
+
+    n_games = n_plays = 0
+    for g, future in completed:
+        try:
+            play_by_play = future.result()
+        except Exception as e:
+            logger.warning('Failed to fetch play by play for game {}: {}'.format(g['game_id'], e))
+            continue
+        n_plays += write_game(engine, g, play_by_play)
+        n_games += 1
+    return n_games, n_plays
+
+
+def main():
+    # offline run against fixtures: python ingest.py data/game_info.json data/sample_game.json
+    with open(sys.argv[1]) as f:
+        schedule = json.load(f)
+    if isinstance(schedule, dict):
+        schedule = [schedule]
+    n_games, n_plays = ingest_games(schedule, fetch=fixture_fetcher(sys.argv[2]))
+    print(f'Wrote {n_games} games and {n_plays} plays')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
-from enum import Enum, auto 
+from enum import Enum, IntEnum, auto 
 
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Boolean, Date
+from sqlalchemy import create_engine, Column, Integer, SmallInteger, String, ForeignKey, Boolean, Date, DateTime, LargeBinary, Index
 from sqlalchemy.orm import relationship, backref, reconstructor
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -13,6 +13,47 @@ class Position(Enum):
     PITCHER = 0
     BATTER = 1
 
+class Result(IntEnum):
+    # canonical play results, stored in Play.resultCode and used to index NumPy lookup arrays
+    DNS = 0
+    OUT = 1
+    WALK = 2
+    SINGLE = 3
+    DOUBLE = 4
+    TRIPLE = 5
+    HOME_RUN = 6
+
+    @property
+    def label(self):
+        """The result as it is spelled in Play.result and the results tables, e.g. 'Home Run'"""
+        return 'DNS' if self is Result.DNS else self.name.replace('_', ' ').title()
+
+    @classmethod
+    def from_label(cls, label: str) -> 'Result':
+        return cls[label.upper().replace(' ', '_')]
+
+# raw statsapi event names that fold into a canonical result, anything else is already canonical
+RAW_RESULTS = {
+    Result.DNS: {'Caught Stealing', 'Caught Stealing 2B', 'Caught Stealing 3B', 'Caught Stealing Home',
+                 'Caught Stealing 2B CS', 'Caught Stealing 3B CS', 'Caught Stealing Home CS',
+                 'Pickoff', 'Pickoff 1B', 'Pickoff 2B', 'Pickoff 3B', 'Pickoff Caught Stealing 2B',
+                 'Pickoff Caught Stealing 3B', 'Pickoff Caught Stealing Home', 'Stolen Base 2B'},
+    Result.OUT: {'Field Error', 'Field Out', 'Fielders Choice', 'Fielders Choice Out',
+                 'Double Play', 'Forceout', 'Game Advisory', 'Grounded Into DP', 'Groundout',
+                 'Lineout', 'Pop Out', 'Runner Out', 'Strikeout', 'Strikeout Double Play', 'Triple Play', 'Batter Out', 'Flyout',
+                 'Sac Bunt', 'Sac Fly', 'Sac Fly Double Play', 'Sac Bunt Double Play',
+                 'Bunt Groundout', 'Bunt Pop Out', 'Bunt Lineout', 'Bunt Flyout',
+                 'Bunt Forceout', 'Bunt Double Play', 'Bunt Grounded Into DP', 'Bunt Out'},
+    Result.WALK: {'Wild Pitch', 'Passed Ball', 'Intent Walk', 'Hit By Pitch', 'Balk', 'Catcher Interference'},
+}
+
+RESULT_CODES = {label: result for result, labels in RAW_RESULTS.items() for label in labels}
+RESULT_CODES.update({result.label: result for result in Result})
+
+def result_code(raw_result: str):
+    """Canonical Result of a raw or already clean event name, None for events no rule covers"""
+    return RESULT_CODES.get(raw_result)
+
 class Team(Base):
     __tablename__ = 'teams'
 
@@ -64,13 +105,17 @@ class PitcherOutcome(Base):
         'home run': 'home_runs',
     }
 
-    def get_outcome_count(self, outcome_str: str):
-        column_name = self.outcome_columns[outcome_str.lower()]
+    # the same columns keyed by Result, in outcome_columns order
+    result_columns = {Result.from_label(outcome): column for outcome, column in outcome_columns.items()}
+
+    def get_outcome_count(self, outcome):
+        # outcome is a Result or its label
+        column_name = self.result_columns[outcome if isinstance(outcome, Result) else Result.from_label(outcome)]
         return getattr(self, column_name)
     
-    def increment_outcome_count(self, outcome_str: str, increment=1):
+    def increment_outcome_count(self, outcome, increment=1):
         # still need to session.commit() after calling this
-        column_name = self.outcome_columns[outcome_str.lower()]
+        column_name = self.result_columns[outcome if isinstance(outcome, Result) else Result.from_label(outcome)]
         current_value = getattr(self, column_name)
         new_value = current_value + increment
         setattr(self, column_name, new_value)
@@ -83,7 +128,7 @@ class Pitcher(Base):
     __tablename__ = 'pitchers'
 
     id = Column(Integer, primary_key=True)
-    playerId = Column(Integer, ForeignKey('players.id'))
+    playerId = Column(Integer, ForeignKey('players.id'), index=True)
     ratingId = Column(Integer, ForeignKey('pitcher_ratings.id'))
     pitchHand = Column(String(10))
     n_plays = Column(Integer, default=0)
@@ -103,7 +148,7 @@ class Batter(Base):
     __tablename__ = 'batters'
 
     id = Column(Integer, primary_key=True)
-    playerId = Column(Integer, ForeignKey('players.id'))
+    playerId = Column(Integer, ForeignKey('players.id'), index=True)
     ratingId = Column(Integer, ForeignKey('batter_ratings.id'))
     batSide = Column(String(10))
     n_plays = Column(Integer, default=0)
@@ -119,6 +164,11 @@ class Batter(Base):
 
 class Game(Base):
     __tablename__ = 'games'
+    __table_args__ = (
+        # covers the chronological scan of one split without touching the table
+        Index('ix_games_training_date', 'training', 'date', 'id'),
+        Index('ix_games_date', 'date'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=False)
 
@@ -134,14 +184,22 @@ class Game(Base):
 
 class Play(Base):
     __tablename__ = 'plays'
+    __table_args__ = (
+        Index('ix_plays_pitcherId_resultCode', 'pitcherId', 'resultCode'),
+        Index('ix_plays_batterId_resultCode', 'batterId', 'resultCode'),
+        Index('ix_plays_resultCode', 'resultCode'),
+        # plays are clustered by game so that a game's plays sit together on disk, in at-bat order
+        {'sqlite_with_rowid': False},
+    )
 
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    gameId = Column(Integer, ForeignKey('games.id'), primary_key=True, autoincrement=False)
+    atBatIndex = Column(Integer, primary_key=True, autoincrement=False)
 
-    gameId = Column(Integer, ForeignKey('games.id'))
     result = Column(String(255))
+    # canonical Result of the raw event in result, written on ingest and backfilled by data_clean.clean_play_outcomes
+    resultCode = Column(SmallInteger)
     pitcherId = Column(Integer, ForeignKey('pitchers.playerId'))
     batterId = Column(Integer, ForeignKey('batters.playerId'))
-    atBatIndex = Column(Integer)
     inning = Column(Integer)
     outs = Column(Integer)
     runnersOn = Column(Integer)
@@ -176,4 +234,24 @@ class BatterRating(Base):
         return f"{self.value}"
 
 
+class RatingSnapshot(Base):
+    __tablename__ = 'rating_snapshots'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    model = Column(String(255), nullable=False)
+    version = Column(Integer, nullable=False)
+    createdAt = Column(DateTime, nullable=False)
+    # npz archive holding the full rating vectors of a trained model
+    data = Column(LargeBinary, nullable=False)
+
+    def __str__(self):
+        return f"{self.id}: {self.model} v{self.version}, {self.createdAt}"
+
+
+class IngestCheckpoint(Base):
+    __tablename__ = 'ingest_checkpoints'
 
+    # a game is only checkpointed once it and all of its plays are committed
+    gameId = Column(Integer, ForeignKey('games.id'), primary_key=True, autoincrement=False)
+    nPlays = Column(Integer, nullable=False)
+    finishedAt = Column(DateTime, nullable=False)
@@ -0,0 +1,188 @@
+import sys
+import tempfile
+
+import numpy as np
+
+from db_utils import create_session_scope
+from elo_engine import player_indices
+from evaluation import evaluate_models, write_report, score_lookup
+from features import FeatureBuilder, FEATURES, CONTEXT_FEATURES
+from models import Result
+from play_store import PlayStore, load_play_store
+from prediction_model import PredictionModel, EloModel, results_table, partial_results_table
+
+# classes the model predicts: every result a play can end in, DNS plays are never fitted
+CLASSES = tuple(result for result in Result if result != Result.DNS)
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class MultinomialModel(PredictionModel):
+    """Softmax over the play results with a strength per result class for every pitcher and batter
+
+        The logit of class k for a matchup is bias[k] + pitcher_strength[p, k] + batter_strength[b, k].
+        Strengths are fitted jointly by mini-batch gradient descent with AdaGrad step sizes, which suits
+        parameters like these that each appear in only a few plays of a batch. Walks are a class of their
+        own, so the five partial outcomes are the remaining classes renormalized, the same plays
+        categorical cross-entropy is scored on.
+
+        Given a features.FeatureBuilder, the logits also get a linear term in the standardized feature
+        columns, fitted with the strengths. Only replay_many sees a play's context, predictions from
+        player ids alone take every feature at its training mean.
+    """
+
+    def __init__(self, results_table=results_table, partial_results_table=partial_results_table,
+                 learning_rate: float = 0.1, l2: float = 1e-4, epochs: int = 10, batch_size: int = 4096, seed: int = 0,
+                 features: FeatureBuilder = None, feature_names=CONTEXT_FEATURES):
+        self.learning_rate = learning_rate
+        self.l2 = l2
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.seed = seed
+        self.set_results_tables(results_table, partial_results_table)
+        self.pitcher_ids = self.batter_ids = np.zeros(0, dtype=np.int64)
+        self.bias = np.zeros(len(CLASSES))
+        self.pitcher_strength = np.zeros((1, len(CLASSES)))
+        self.batter_strength = np.zeros((1, len(CLASSES)))
+        self.features = features
+        self.feature_names = tuple(feature_names) if features is not None else ()
+        self.feature_mean = np.zeros(len(self.feature_names))
+        self.feature_std = np.ones(len(self.feature_names))
+        self.feature_weights = np.zeros((len(self.feature_names), len(CLASSES)))
+
+    def set_results_tables(self, results_table, partial_results_table):
+        self.results_table = results_table
+        self.partial_results_table = partial_results_table
+        self.class_scores = score_lookup(results_table)[list(CLASSES)]
+        # columns of the partial outcome distribution, in partial_results_table order
+        self.partial_columns = np.array([CLASSES.index(Result.from_label(result)) for result in partial_results_table])
+        self.partial_scores = np.array(list(partial_results_table.values()), dtype=np.float64)
+
+    def design_matrix(self, plays: PlayStore) -> np.ndarray:
+        """Standardized feature columns of the plays, a feature missing for a play sits at its training mean"""
+        if not self.feature_names:
+            return np.zeros((len(plays), 0))
+        matrix = (self.features.build(plays, self.feature_names) - self.feature_mean) / self.feature_std
+        return np.nan_to_num(matrix, copy=False)
+
+    def fit(self, plays: PlayStore):
+        """Fit every strength from scratch on the plays"""
+        # features are built before DNS plays are dropped, play-end state carries over from them
+        matrix = self.features.build(plays, self.feature_names) if self.feature_names else np.zeros((len(plays), 0))
+        fitted = plays.result != Result.DNS
+        plays, matrix = plays.select(fitted), matrix[fitted]
+        self.feature_mean = np.nanmean(matrix, axis=0) if len(matrix) else np.zeros(matrix.shape[1])
+        self.feature_std = np.nanstd(matrix, axis=0) if len(matrix) else np.ones(matrix.shape[1])
+        self.feature_std[~(self.feature_std > 0)] = 1
+        matrix = np.nan_to_num((matrix - self.feature_mean) / self.feature_std, copy=False)
+
+        labels = plays.result.astype(np.int64) - 1
+        self.pitcher_ids = np.unique(plays.pitcherId).astype(np.int64)
+        self.batter_ids = np.unique(plays.batterId).astype(np.int64)
+        pitcher_index = player_indices(self.pitcher_ids, plays.pitcherId, missing=len(self.pitcher_ids))
+        batter_index = player_indices(self.batter_ids, plays.batterId, missing=len(self.batter_ids))
+
+        n_classes = len(CLASSES)
+        # start from the overall result frequencies, strengths then only have to explain the deviations
+        frequencies = np.bincount(labels, minlength=n_classes) + 1
+        self.bias = np.log(frequencies / frequencies.sum())
+        # one extra zero row each for players the model has never seen, player_indices maps them past the end
+        self.pitcher_strength = np.zeros((len(self.pitcher_ids) + 1, n_classes))
+        self.batter_strength = np.zeros((len(self.batter_ids) + 1, n_classes))
+        self.feature_weights = np.zeros((matrix.shape[1], n_classes))
+        parameters = (self.bias, self.pitcher_strength, self.batter_strength, self.feature_weights)
+        squared_gradients = [np.full_like(parameter, 1e-8) for parameter in parameters]
+
+        rng = np.random.default_rng(self.seed)
+        one_hot = np.eye(n_classes)
+        for _ in range(self.epochs):
+            order = rng.permutation(len(labels))
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                pitchers, batters = pitcher_index[batch], batter_index[batch]
+                # gradient of the mean cross-entropy with respect to the logits
+                error = (softmax(self.logits(pitchers, batters, matrix[batch])) - one_hot[labels[batch]]) / len(batch)
+
+                pitcher_gradient = np.zeros_like(self.pitcher_strength)
+                batter_gradient = np.zeros_like(self.batter_strength)
+                np.add.at(pitcher_gradient, pitchers, error)
+                np.add.at(batter_gradient, batters, error)
+                gradients = (error.sum(axis=0), pitcher_gradient + self.l2 * self.pitcher_strength,
+                             batter_gradient + self.l2 * self.batter_strength, matrix[batch].T @ error)
+                for parameter, gradient, squared in zip(parameters, gradients, squared_gradients):
+                    squared += gradient ** 2
+                    parameter -= self.learning_rate * gradient / np.sqrt(squared)
+
+    def train(self):
+        with create_session_scope() as session:
+            self.fit(load_play_store(session, training=True))
+
+    def logits(self, pitcher_index, batter_index, matrix=None) -> np.ndarray:
+        logits = self.bias + self.pitcher_strength[pitcher_index] + self.batter_strength[batter_index]
+        if matrix is not None and matrix.shape[1]:
+            logits += matrix @ self.feature_weights
+        return logits
+
+    def predict_proba(self, pitcher_ids, batter_ids, matrix=None) -> np.ndarray:
+        """Probability of every class in CLASSES for each matchup, an (N x len(CLASSES)) matrix
+
+            matrix holds the standardized features of each matchup (see design_matrix), None leaves them at their mean
+        """
+        pitcher_index = player_indices(self.pitcher_ids, pitcher_ids, missing=len(self.pitcher_ids))
+        batter_index = player_indices(self.batter_ids, batter_ids, missing=len(self.batter_ids))
+        return softmax(self.logits(pitcher_index, batter_index, matrix))
+
+    def outcomes(self, probabilities: np.ndarray):
+        """(partial, outcomes) from class probabilities, outcomes conditioned on a partial result like the plays they are scored on"""
+        outcomes = probabilities[:, self.partial_columns]
+        outcomes /= outcomes.sum(axis=1, keepdims=True)
+        return outcomes @ self.partial_scores, outcomes
+
+    def predict_many(self, pitcher_ids, batter_ids):
+        return self.predict_proba(pitcher_ids, batter_ids) @ self.class_scores
+
+    def predict_outcomes_many(self, pitcher_ids, batter_ids):
+        return self.outcomes(self.predict_proba(pitcher_ids, batter_ids))
+
+    def predict(self, play):
+        return float(self.predict_many([play.pitcherId], [play.batterId])[0])
+
+    def predict_partial(self, play):
+        return self.predict_partial_outcomes(play)[0]
+
+    def predict_partial_outcomes(self, play):
+        partial, outcomes = self.predict_outcomes_many([play.pitcherId], [play.batterId])
+        return float(partial[0]), outcomes[0].tolist()
+
+    def replay_many(self, plays: PlayStore):
+        probabilities = self.predict_proba(plays.pitcherId, plays.batterId, self.design_matrix(plays))
+        return (probabilities @ self.class_scores, *self.outcomes(probabilities))
+
+
+def main():
+    # python multinomial_model.py [epochs] [report.json]
+    epochs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with create_session_scope() as session, tempfile.TemporaryDirectory() as directory:
+        training_plays = load_play_store(session, training=True)
+        testing_plays = load_play_store(session, training=False)
+        # replay Elo from scratch over the training split, so each play's rating features come from before its date
+        elo = EloModel(session)
+        elo.reset_ratings()
+        elo.record_history(directory)
+        elo.fit(training_plays)
+        features = FeatureBuilder(session, history=elo.history)
+
+        models = {
+            "Multinomial": MultinomialModel(epochs=epochs),
+            "Multinomial + features": MultinomialModel(epochs=epochs, features=features, feature_names=FEATURES),
+        }
+        for model in models.values():
+            model.fit(training_plays)
+        write_report(evaluate_models(models, testing_plays), sys.argv[2] if len(sys.argv) > 2 else None)
+
+
+if __name__ == "__main__":
+    main()
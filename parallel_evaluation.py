@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from db_utils import create_session_scope
+from evaluation import evaluate, write_report
+from play_store import PlayStore, load_play_store
+from prediction_model import EloModel, DumbModel, RandomModel, results_table, partial_results_table
+
+# one model evaluated under one pair of results tables
+EvaluationJob = namedtuple('EvaluationJob', ['name', 'model', 'results_table', 'partial_results_table'],
+                           defaults=[results_table, partial_results_table])
+
+# what each worker process of a shared_plays_pool attached to, the shared objects and the memory-mapped stores by name
+worker_state: dict = {}
+
+
+def _attach(shared: dict, directories: dict):
+    worker_state.clear()
+    worker_state.update(shared)
+    worker_state.update({name: PlayStore.open(directory) for name, directory in directories.items()})
+
+
+@contextmanager
+def shared_plays_pool(stores: dict, shared: dict = None, max_workers: int = None, directory: str = None):
+    """A ProcessPoolExecutor whose workers find every store, memory-mapped, and shared object in worker_state
+
+        Each store is written once to <directory>/<name> (a temporary directory by default) and every worker
+        maps it read-only instead of receiving a pickled copy with each task. The shared objects, such as a
+        base model, are sent once per worker.
+    """
+    with tempfile.TemporaryDirectory() as tmp_directory:
+        directory = directory or tmp_directory
+        directories = {name: os.path.join(directory, name) for name in stores}
+        for name, plays in stores.items():
+            plays.save(directories[name])
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=_attach,
+                                 initargs=(shared or {}, directories)) as pool:
+            yield pool
+
+
+def _run_job(job: EvaluationJob):
+    return job.name, evaluate(job.model, worker_state['plays'], job.results_table, job.partial_results_table)
+
+
+def evaluate_parallel(jobs: list[EvaluationJob], plays: PlayStore, max_workers: int = None, directory: str = None) -> dict:
+    """Evaluate every job in a process pool, with all workers sharing one memory-mapped copy of the plays
+
+        The plays are written under directory (a temporary directory by default) and each worker maps them
+        read-only instead of querying the database. Returns the same report layout as evaluate_models.
+    """
+    names = [job.name for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Job names must be unique, repeated: {', '.join(duplicates)}")
+    with shared_plays_pool({'plays': plays}, max_workers=max_workers, directory=directory) as pool:
+        results = dict(pool.map(_run_job, jobs))
+
+    return {
+        'n_test_plays': len(plays),
+        'models': {job.name: results[job.name] for job in jobs},
+    }
+
+
+def main():
+    with create_session_scope() as session:
+        testing_plays = load_play_store(session, training=False)
+        jobs = [
+            EvaluationJob("Elo", EloModel(session)),
+            EvaluationJob("Baseline", DumbModel()),
+            EvaluationJob("Random", RandomModel()),
+        ]
+
+    report = evaluate_parallel(jobs, testing_plays)
+    write_report(report, sys.argv[1] if len(sys.argv) > 1 else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+from collections import namedtuple
+import os
+
+import numpy as np
+from sqlalchemy import text, bindparam, Date
+from sqlalchemy.orm import Session
+
+from models import Result
+
+# labels of the canonical play results, the index of each label is its Result code
+RESULTS = tuple(result.label for result in Result)
+
+
+class PlayRow(namedtuple('PlayRow', ['gameId', 'date', 'pitcherId', 'batterId', 'resultCode', 'inning', 'outs', 'runnersOn'])):
+    """Lightweight stand-in for a Play ORM object, exposes the same attribute names"""
+    __slots__ = ()
+
+    @property
+    def result(self) -> str:
+        """The result's label, for display, scores are looked up by resultCode"""
+        return RESULTS[self.resultCode]
+
+
+# plays fetched per round trip when streaming a split
+BATCH_SIZE = 100_000
+
+# the result column of the play loaders, a missing resultCode comes back as -1
+RESULT_CODE_COLUMN = 'COALESCE(plays."resultCode", -1)'
+
+
+def plays_query(where: str = '', result: str = RESULT_CODE_COLUMN) -> str:
+    """The chronological scan of plays joined to games behind every play loader, filtered by a WHERE clause"""
+    return f"""
+    SELECT plays."gameId", games.date, plays."pitcherId", plays."batterId", {result},
+           COALESCE(plays.inning, -1), COALESCE(plays.outs, -1), COALESCE(plays."runnersOn", -1)
+    FROM plays
+    JOIN games ON games.id = plays."gameId"
+    {where}
+    ORDER BY games.date, plays."gameId", plays."atBatIndex"
+"""
+
+
+PLAYS_QUERY = plays_query('WHERE games.training = :training')
+# every play regardless of the training split, for backtests that pick their own windows
+ALL_PLAYS_QUERY = plays_query()
+# only the plays after a (date, gameId) high-water mark, for incremental training
+PLAYS_AFTER_QUERY = plays_query(
+    'WHERE games.training = :training AND (games.date > :after_date OR (games.date = :after_date AND plays."gameId" > :after_game))'
+)
+
+
+class PlayStore:
+    """Plays held as parallel NumPy arrays, ordered chronologically by (date, gameId, atBatIndex)"""
+
+    columns = ('gameId', 'date', 'pitcherId', 'batterId', 'result', 'inning', 'outs', 'runnersOn')
+
+    def __init__(self, gameId, date, pitcherId, batterId, result, inning, outs, runnersOn):
+        self.gameId = np.asarray(gameId, dtype=np.int64)
+        self.date = np.asarray(date, dtype='datetime64[D]')
+        self.pitcherId = np.asarray(pitcherId, dtype=np.int32)
+        self.batterId = np.asarray(batterId, dtype=np.int32)
+        self.result = np.asarray(result, dtype=np.int8)
+        self.inning = np.asarray(inning, dtype=np.int8)
+        self.outs = np.asarray(outs, dtype=np.int8)
+        self.runnersOn = np.asarray(runnersOn, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.gameId)
+
+    def save(self, directory: str):
+        """Write each column to its own .npy file so that other processes can memory-map the store"""
+        os.makedirs(directory, exist_ok=True)
+        for column in self.columns:
+            np.save(os.path.join(directory, column + '.npy'), getattr(self, column))
+
+    @classmethod
+    def open(cls, directory: str, mmap_mode='r') -> 'PlayStore':
+        """Attach to a store written by save, sharing its pages instead of reading a private copy"""
+        return cls(*(np.load(os.path.join(directory, column + '.npy'), mmap_mode=mmap_mode) for column in cls.columns))
+
+    def __iter__(self):
+        return self.iter_rows(0, len(self))
+
+    def iter_rows(self, start: int, end: int):
+        columns = [getattr(self, column)[start:end].tolist() for column in self.columns]
+        for values in zip(*columns):
+            yield PlayRow(*values)
+
+    def select(self, index) -> 'PlayStore':
+        """A new store holding only the plays picked out by a boolean mask or index array"""
+        return PlayStore(*(getattr(self, column)[index] for column in self.columns))
+
+    def game_bounds(self) -> np.ndarray:
+        """Offsets where each game starts, followed by len(self), so game i is [bounds[i], bounds[i+1])"""
+        if len(self) == 0:
+            return np.zeros(1, dtype=np.int64)
+        starts = np.flatnonzero(np.diff(self.gameId)) + 1
+        return np.concatenate(([0], starts, [len(self)]))
+
+    def n_games(self) -> int:
+        return len(self.game_bounds()) - 1
+
+
+def check_result_codes(codes) -> np.ndarray:
+    codes = np.asarray(codes, dtype=np.int8)
+    # the queries turn a missing resultCode into -1
+    if (codes < 0).any():
+        raise ValueError("Plays without a result code, run data_clean.clean_play_outcomes first")
+    return codes
+
+
+def store_from_rows(rows) -> PlayStore:
+    """PlayStore from PLAYS_QUERY rows"""
+    if not rows:
+        return PlayStore(*([] for _ in PlayStore.columns))
+
+    gameId, date, pitcherId, batterId, result, inning, outs, runnersOn = zip(*rows)
+    return PlayStore(gameId, date, pitcherId, batterId, check_result_codes(result), inning, outs, runnersOn)
+
+
+def execute_plays_query(session: Session, training: bool = True, after=None, **execution_options):
+    """Run PLAYS_QUERY, or PLAYS_AFTER_QUERY when after is a (date, gameId) mark, or ALL_PLAYS_QUERY when training is None"""
+    if training is None:
+        if after is not None:
+            raise ValueError("A high-water mark only applies within one split")
+        return session.execute(text(ALL_PLAYS_QUERY), execution_options=execution_options)
+    if after is None:
+        return session.execute(text(PLAYS_QUERY), {'training': training}, execution_options=execution_options)
+    after_date, after_game = after
+    statement = text(PLAYS_AFTER_QUERY).bindparams(bindparam('after_date', type_=Date))
+    return session.execute(statement, {'training': training, 'after_date': after_date, 'after_game': after_game},
+                           execution_options=execution_options)
+
+
+def load_play_store(session: Session, training: bool = True, after=None) -> PlayStore:
+    """Build a PlayStore from a single scan of plays joined to games
+
+        training=None loads both splits, after=(date, gameId) keeps only the games after that mark
+    """
+    return store_from_rows(execute_plays_query(session, training, after).fetchall())
+
+
+def stream_play_rows(session: Session, training: bool = True, batch_size: int = BATCH_SIZE, after=None):
+    """Yield PLAYS_QUERY rows in lists of batch_size, fetched from a server-side cursor so only one batch is held"""
+    result = execute_plays_query(session, training, after, stream_results=True)
+    yield from result.partitions(batch_size)
+
+
+def iter_play_stores(session: Session, training: bool = True, batch_size: int = BATCH_SIZE, after=None):
+    """Stream a split as PlayStores of roughly batch_size plays, each holding only whole games
+
+        Feeding the chunks in order to a model gives the same result as one load_play_store, in bounded memory.
+    """
+    carry = []
+    for rows in stream_play_rows(session, training, batch_size, after):
+        rows = carry + rows
+        # the last game may continue into the next batch, so hold it back
+        last_game = rows[-1][0]
+        end = len(rows)
+        while end > 0 and rows[end - 1][0] == last_game:
+            end -= 1
+        carry = rows[end:]
+        if end:
+            yield store_from_rows(rows[:end])
+    if carry:
+        yield store_from_rows(carry)
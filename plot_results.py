@@ -2,13 +2,13 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from prediction_model import PredictionModel, EloModel, DumbModel, RandomModel, results_table, partial_results_table
-from db_utils import get_all_plays, create_session_scope
+from db_utils import create_session_scope, iter_plays
 
 def get_differences(model: PredictionModel, session, results_table=partial_results_table):
     differences = []
-    testing_plays = get_all_plays(session, training=False)
 
-    for play in testing_plays:
+    # the test split is streamed play by play, only one batch of rows is held at a time
+    for play in iter_plays(session, training=False):
         result = play.result
         prediction = model.predict_partial(play)
         observed = results_table[result]
@@ -26,8 +26,7 @@ def get_running_wins(model: PredictionModel, session, results_table=partial_resu
 
     running_wins = []
 
-    testing_plays = get_all_plays(session, training=False)
-    for play in testing_plays:
+    for play in iter_plays(session, training=False):
         result = play.result
         prediction = model.predict_partial(play)
         observed = results_table[result]
@@ -1,22 +1,38 @@
 from abc import abstractmethod
+from collections import namedtuple
 from sqlalchemy.orm import Session
+import copy
+import io
 import random
-
-from utils import calculate_ev, basic_func, linear_func, calculate_xp
-from db_utils import get_all_games
-from models import Pitcher, Batter, Play, Position
-from progressbar import progressbar
+import time
+from datetime import timedelta
+import numpy as np
+
+from utils import basic_func, linear_func, SIGMA, INITIAL_RATING
+from play_store import PlayStore, load_play_store, iter_play_stores, RESULTS
+from elo_engine import simulate_games, independent_blocks, replay_plays, player_indices, position_indices, expected_scores
+from models import PitcherOutcome, Play, Position
+from rating_history import RatingHistory, HISTORY_DIR
+from db_utils import bulk_update_ratings, get_player_ratings, get_pitcher_outcome_counts, save_rating_snapshot, load_rating_snapshot
+
+def make_results_table(results_func):
+    """The batter's score for each result label
+
+        A score of -1 means the result is not scored: plays that did not finish (DNS) are skipped by
+        every rating update and left out of every metric.
+    """
+    return {
+        'DNS': -1,
+        'Out': 0.0,
+        'Walk': results_func(1),
+        'Single': results_func(2),
+        'Double': results_func(3),
+        'Triple': results_func(4),
+        'Home Run': results_func(5),
+    }
 
 results_func = basic_func
-results_table = {
-    'DNS': -1,
-    'Out': 0.0,
-    'Walk': results_func(1),
-    'Single': results_func(2),
-    'Double': results_func(3),
-    'Triple': results_func(4),
-    'Home Run': results_func(5),
-}
+results_table = make_results_table(results_func)
 
 results_fnc = linear_func
 partial_results_table = {
@@ -28,6 +44,8 @@ partial_results_table = {
 }
 
 
+# everything a model predicts for a single play
+Prediction = namedtuple('Prediction', ['hit', 'partial', 'outcomes'])
 
 class PredictionModel:
 
@@ -47,176 +65,480 @@ class PredictionModel:
     def predict_partial_outcomes(self, play) -> tuple[float, list[float]]:
         pass
 
-class EloModel:
-    ### can only exist within a session scope
+    @abstractmethod
+    def predict_many(self, pitcher_ids, batter_ids) -> np.ndarray:
+        pass
 
-    def __init__(self, session: Session, results_table=results_table, partial_results_table=partial_results_table):    
-        all_pitchers = session.query(Pitcher).all()
-        all_batters = session.query(Batter).all()
+    @abstractmethod
+    def predict_outcomes_many(self, pitcher_ids, batter_ids) -> tuple[np.ndarray, np.ndarray]:
+        pass
+
+    def update(self, play):
+        """Learn from an observed play, models that do not learn online ignore it"""
+        pass
+
+    def replay(self, plays):
+        """Stream a Prediction for each play in order, updating the model with each play after predicting it"""
+        for play in plays:
+            partial, outcomes = self.predict_partial_outcomes(play)
+            yield Prediction(self.predict(play), partial, outcomes)
+            self.update(play)
 
-        pitchers_table = {pitcher.playerId: pitcher for pitcher in all_pitchers}
-        batters_table = {batter.playerId: batter for batter in all_batters}
+    def replay_many(self, plays: PlayStore) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Array version of replay over a whole PlayStore
 
-        self.player_tables = [pitchers_table, batters_table] # lines up with Position enum
+            returns: (hit, partial, outcomes) arrays, outcomes being (N x 5). Models that learn online
+            must override this, the default only suits models that ignore update
+        """
+        hit = self.predict_many(plays.pitcherId, plays.batterId)
+        partial, outcomes = self.predict_outcomes_many(plays.pitcherId, plays.batterId)
+        return hit, partial, outcomes
 
-        pitcher_ratings = {pitcher.playerId: pitcher.rating.value for pitcher in all_pitchers}
-        batter_ratings = {batter.playerId: batter.rating.value for batter in all_batters}
+    def copy(self):
+        return copy.copy(self)
 
-        self.ratings_tables = [pitcher_ratings, batter_ratings]
+def predict_matchup_grid(model: PredictionModel, pitcher_ids, batter_ids) -> np.ndarray:
+    """Hit probability of every pitcher against every batter, as a (len(pitcher_ids) x len(batter_ids)) matrix"""
+    pitcher_grid, batter_grid = np.meshgrid(pitcher_ids, batter_ids, indexing='ij')
+    return model.predict_many(pitcher_grid.ravel(), batter_grid.ravel()).reshape(pitcher_grid.shape)
+
+class EloModel(PredictionModel):
+    ### can only exist within a session scope
+
+    SNAPSHOT_VERSION = 2
+
+    def __init__(self, session: Session, results_table=results_table, partial_results_table=partial_results_table):    
+        player_ids, rating_ids, ratings = [], [], []
+        for position in Position:
+            rows = get_player_ratings(session, position)
+            player_ids.append(np.array([row[0] for row in rows], dtype=np.int64))
+            rating_ids.append(np.array([row[1] for row in rows], dtype=np.int64))
+            ratings.append(np.array([row[2] for row in rows], dtype=np.float64))
+
+        self.set_ratings(player_ids, ratings, rating_ids)
+        # last values written to the database, used to find the dirty ratings on write-back
+        self.stored_ratings = [ratings.copy() for ratings in self.ratings]
+        # plays each player has been trained on, the experience that use_xp scales updates by
+        self.xp_counts = [np.zeros(len(ids), dtype=np.int64) for ids in self.player_ids]
 
         self.session = session
+        self.snapshot_id = None
+        # (date, gameId) of the last game trained on, incremental training starts after it
+        self.trained_through = None
+        # rating checkpoints taken while training, see record_history
+        self.history = None
 
+        self.K = 16
+        self.sigma = SIGMA
+        # scale updates by utils.calculate_xp while training
+        self.use_xp = False
+        self.set_results_tables(results_table, partial_results_table)
+        self.read_outcome_counts()
+
+    def read_outcome_counts(self):
+        """Set the outcome counts of every pitcher in the rating arrays from pitchers and pitcher_outcomes"""
+        rows = get_pitcher_outcome_counts(self.session)
+        rows = [rows[i] for i in player_indices(np.array([row[0] for row in rows], dtype=np.int64), self.player_ids[Position.PITCHER.value])]
+        self.set_outcome_counts(np.array([row[1] for row in rows], dtype=np.int64),
+                                np.array([row[2:] for row in rows], dtype=np.int64).reshape(-1, len(PitcherOutcome.outcome_columns)))
+
+    @classmethod
+    def load(cls, session: Session, snapshot_id: int = None, results_table=results_table, partial_results_table=partial_results_table):
+        """Restore a model from a rating snapshot without going through the ORM, defaults to the latest snapshot"""
+        snapshot_id, version, data = load_rating_snapshot(session, snapshot_id)
+        if version != cls.SNAPSHOT_VERSION:
+            raise ValueError(f"Rating snapshot {snapshot_id} has version {version}, expected {cls.SNAPSHOT_VERSION}")
+        snapshot = np.load(io.BytesIO(data))
+
+        model = cls.__new__(cls)
+        model.set_ratings(
+            [snapshot['pitcher_ids'], snapshot['batter_ids']],
+            [snapshot['pitcher_ratings'], snapshot['batter_ratings']],
+            [snapshot['pitcher_rating_ids'], snapshot['batter_rating_ids']],
+        )
+        # the database may hold any other model's ratings, so the first write-back writes every rating
+        model.stored_ratings = [np.full_like(ratings, np.nan) for ratings in model.ratings]
+        if 'pitcher_xp_counts' in snapshot.files:
+            model.xp_counts = [snapshot['pitcher_xp_counts'], snapshot['batter_xp_counts']]
+        else:
+            model.xp_counts = [np.zeros(len(ids), dtype=np.int64) for ids in model.player_ids]
+
+        model.session = session
+        model.snapshot_id = snapshot_id
+        model.history = None
+        model.trained_through = None
+        if 'trained_through_game' in snapshot.files:
+            model.trained_through = (snapshot['trained_through_date'].item(), int(snapshot['trained_through_game']))
+
+        model.K = float(snapshot['K'])
+        # snapshots written before sigma and use_xp were stored used the defaults
+        model.sigma = float(snapshot['sigma']) if 'sigma' in snapshot.files else SIGMA
+        model.use_xp = bool(snapshot['use_xp']) if 'use_xp' in snapshot.files else False
+        model.set_results_tables(results_table, partial_results_table)
+        model.set_outcome_counts(snapshot['pitcher_n_plays'], snapshot['pitcher_outcome_counts'])
+        return model
+
+    def save_snapshot(self) -> int:
+        """Store the full rating vectors as one versioned npz blob in rating_snapshots"""
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            pitcher_ids=self.player_ids[Position.PITCHER.value],
+            pitcher_ratings=self.ratings[Position.PITCHER.value],
+            pitcher_rating_ids=self.rating_ids[Position.PITCHER.value],
+            batter_ids=self.player_ids[Position.BATTER.value],
+            batter_ratings=self.ratings[Position.BATTER.value],
+            batter_rating_ids=self.rating_ids[Position.BATTER.value],
+            pitcher_n_plays=self.pitcher_n_plays,
+            pitcher_outcome_counts=self.pitcher_outcome_counts,
+            K=self.K,
+            sigma=self.sigma,
+            use_xp=self.use_xp,
+            pitcher_xp_counts=self.xp_counts[Position.PITCHER.value],
+            batter_xp_counts=self.xp_counts[Position.BATTER.value],
+            # a model that has not been trained has no high-water mark to store
+            **({} if self.trained_through is None else {
+                'trained_through_date': np.datetime64(self.trained_through[0], 'D'),
+                'trained_through_game': self.trained_through[1],
+            }),
+        )
+        self.snapshot_id = save_rating_snapshot(self.session, 'elo', self.SNAPSHOT_VERSION, buffer.getvalue())
+        return self.snapshot_id
+
+    def set_ratings(self, player_ids, ratings, rating_ids):
+        # ratings are kept in arrays aligned with the sorted player ids so that whole games can be updated at once
+        self.player_ids = player_ids # lines up with Position enum
+        self.player_index = [{player_id: i for i, player_id in enumerate(ids.tolist())} for ids in self.player_ids]
+        self.ratings = [np.array(values, dtype=np.float64) for values in ratings]
+        self.rating_ids = rating_ids
+
+    def add_new_players(self):
+        """Extend the rating arrays with players added to the database since the ratings were set
+
+            New players keep their stored rating, and the outcome counts of every pitcher are reread.
+            returns: (n_new_pitchers, n_new_batters)
+        """
+        player_ids, ratings, rating_ids, stored_ratings, xp_counts, n_new = [], [], [], [], [], []
+        for position in Position:
+            rows = get_player_ratings(self.session, position)
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            new = ~np.isin(ids, self.player_ids[position.value])
+            n_new.append(int(np.count_nonzero(new)))
+
+            order = np.argsort(np.concatenate((self.player_ids[position.value], ids[new])), kind='stable')
+            player_ids.append(np.concatenate((self.player_ids[position.value], ids[new]))[order])
+            ratings.append(np.concatenate((self.ratings[position.value], np.array([row[2] for row in rows], dtype=np.float64)[new]))[order])
+            rating_ids.append(np.concatenate((self.rating_ids[position.value], np.array([row[1] for row in rows], dtype=np.int64)[new]))[order])
+            # new players have never been written back
+            stored_ratings.append(np.concatenate((self.stored_ratings[position.value], np.full(n_new[-1], np.nan)))[order])
+            xp_counts.append(np.concatenate((self.xp_counts[position.value], np.zeros(n_new[-1], dtype=np.int64)))[order])
+
+        self.set_ratings(player_ids, ratings, rating_ids)
+        self.stored_ratings = stored_ratings
+        self.xp_counts = xp_counts
+        if self.history is not None:
+            self.history.add_players(self.player_ids)
+        self.read_outcome_counts()
+        return n_new[Position.PITCHER.value], n_new[Position.BATTER.value]
+
+    def reset_ratings(self, rating=INITIAL_RATING):
+        """Put every player back to the same starting rating, for training from scratch in memory"""
+        self.ratings = [np.full_like(ratings, rating) for ratings in self.ratings]
+
+    def set_results_tables(self, results_table, partial_results_table):
         self.results_table = results_table
         self.partial_results_table = partial_results_table
-        self.K = 16
         self.results_as_integers = {result: i for i, result in enumerate(self.partial_results_table.keys())}
-        
-
-    def update_ratings(self, ratings, position: Position):
-        i = 0
-        for player_id, rating in ratings:
-            player = self.player_tables[position][player_id]
-            if player.rating.value != rating:
-                player.rating.value = rating
-                self.session.add(player)
-                if i % 250 == 0:
-                    self.session.commit()
-                i += 1
-
-    def simulate_elo(self, suppress_output=True):
-        games = get_all_games(self.session, training=True)
-        n_plays_pitchers_table = {playerId: 0 for playerId in self.player_tables[Position.PITCHER.value].keys()}
-        n_plays_batters_table = {playerId: 0 for playerId in self.player_tables[Position.BATTER.value].keys()}
+        # score of each play result indexed by its integer code in the play store
+        self.result_scores = np.array([self.results_table[result] for result in RESULTS], dtype=np.float64)
+
+    def set_outcome_counts(self, n_plays: np.ndarray, outcome_counts: np.ndarray):
+        """Precompute every pitcher's hit-type frequencies from their play and outcome counts
+
+            outcome_counts has one row per pitcher and one column per PitcherOutcome.outcome_columns entry
+        """
+        self.pitcher_n_plays = n_plays
+        self.pitcher_outcome_counts = outcome_counts
+        count_columns = {outcome: i for i, outcome in enumerate(PitcherOutcome.outcome_columns)}
+
+        n_hits = n_plays - outcome_counts[:, count_columns['out']]
+        no_hits = n_hits == 0
+        # outcome_freqs[:, i - 1] is the frequency of the partial result with integer i, out (i = 0) is left to 1 - e_b
+        self.outcome_freqs = np.zeros((len(n_plays), len(self.partial_results_table) - 1))
+        hit_values = np.zeros(len(self.partial_results_table) - 1)
+        for outcome, value in self.partial_results_table.items():
+            if value <= 0:
+                continue
+            outcome_ind = self.results_as_integers[outcome] - 1
+            self.outcome_freqs[:, outcome_ind] = outcome_counts[:, count_columns[outcome.lower()]] / np.where(no_hits, 1, n_hits)
+            self.outcome_freqs[no_hits, outcome_ind] = 0.25
+            hit_values[outcome_ind] = value
+        # expected partial value of a hit against each pitcher
+        self.hit_values = self.outcome_freqs @ hit_values
+
+    def get_indices(self, pitcher_ids, batter_ids):
+        """Positions of the given pitcher and batter ids in the rating arrays"""
+        return position_indices(self.player_ids, pitcher_ids, batter_ids)
+
+    def get_rating(self, player_id: int, position: Position):
+        return self.ratings[position.value][self.player_index[position.value][player_id]]
+
+    def update_ratings(self, suppress_output=True):
+        """Write every changed rating back to the database in one transaction
+
+            returns: (n_pitchers_written, n_batters_written, seconds)
+        """
+        start = time.perf_counter()
+        n_written = []
+        for position in Position:
+            dirty = np.flatnonzero(self.ratings[position.value] != self.stored_ratings[position.value])
+            n_written.append(bulk_update_ratings(self.session, position, self.rating_ids[position.value][dirty].tolist(),
+                                                 self.ratings[position.value][dirty].tolist()))
+        self.session.commit()
+        self.stored_ratings = [ratings.copy() for ratings in self.ratings]
+        elapsed = time.perf_counter() - start
 
         if not suppress_output:
-            print('Simulating Games...')
-            games = progressbar(games)
-
-        for game in games:
-            # game_pitcher_rewards tracks the pitcher's expected value and scored value for each game. An update will be made at the end of the game
-            game_pitcher_rewards = dict.fromkeys([play.pitcherId for play in game.plays], [0, 0])
-            game_batter_rewards = dict.fromkeys([play.batterId for play in game.plays], [0, 0])
-            for play in game.plays:
-                if self.results_table[play.result] == -1:
-                    continue
-
-                pitcher: Pitcher = self.player_tables[Position.PITCHER.value][play.pitcherId]
-
-                pitcher_rating = self.ratings_tables[Position.PITCHER.value][play.pitcherId]
-                batter_rating = self.ratings_tables[Position.BATTER.value][play.batterId]
-
-                e_b = calculate_ev(batter_rating, pitcher_rating)
-                e_p = 1 - e_b
-                game_pitcher_rewards[play.pitcherId][0] += e_p
-                game_batter_rewards[play.batterId][0] += e_b
-
-                s_b = self.results_table[play.result]
-                s_p = 1 - s_b
-                game_pitcher_rewards[play.pitcherId][1] += s_p
-                game_batter_rewards[play.batterId][1] += s_b
-
-                n_plays_pitchers_table[play.pitcherId] += 1
-                n_plays_batters_table[play.batterId] += 1
-
-            for pitcher_id, (e_p, s_p) in game_pitcher_rewards.items():
-                # xp_factor = calculate_xp(n_plays_pitchers_table[pitcher_id])
-                xp_factor = 1
-                change = self.K * (s_p - e_p) * xp_factor
-                self.ratings_tables[Position.PITCHER.value][pitcher_id] += change
-
-            for batter_id, (e_b, s_b) in game_batter_rewards.items():
-                # xp_factor = calculate_xp(n_plays_batters_table[batter_id])
-                xp_factor = 1
-                change = self.K * (s_b - e_b) * xp_factor
-                self.ratings_tables[Position.BATTER.value][batter_id] += change
-            
-        pitcher_ratings = self.ratings_tables[Position.PITCHER.value].items()
+            print(f"Wrote {n_written[Position.PITCHER.value]} pitcher and {n_written[Position.BATTER.value]} batter ratings in {elapsed:.3f}s")
+        return n_written[Position.PITCHER.value], n_written[Position.BATTER.value], elapsed
+
+    def simulate_elo(self, suppress_output=True, batch_size=None, after=None):
+        # with a batch size the training split is streamed in game-aligned chunks instead of loaded whole
+        if batch_size is None:
+            plays = load_play_store(self.session, training=True, after=after)
+        else:
+            plays = iter_play_stores(self.session, True, batch_size, after)
         if not suppress_output:
-            print("updating pitcher ratings...")
-            pitcher_ratings = progressbar(pitcher_ratings)
-        self.update_ratings(pitcher_ratings, Position.PITCHER.value)
-        
-        batter_ratings = self.ratings_tables[Position.BATTER.value].items()
+            print('Simulating Games...')
+
+        self.fit(plays, resume=after is not None)
+
         if not suppress_output:
-            print("updating batter ratings...")
-            batter_ratings = progressbar(batter_ratings)
-        self.update_ratings(batter_ratings, Position.BATTER.value)
-
-    def train(self, suppress_output=True):
-        self.simulate_elo(suppress_output=suppress_output)
-
-    def calculate_ev(self, batter_rating, pitcher_rating, pitcher: Pitcher, batter: Batter, play: Play):
-        e_b = 1 / (1 + 10 ** ((pitcher_rating - batter_rating) / 400))
-        # now, given the probability of a hit, calculate the expected value of that hit and multiply by the probability of a hit
-        hit_value = 0
-        outcome_freqs = {i: 0 for i in range(1, len(self.partial_results_table))}
-        n_outs = pitcher.outcomes.get_outcome_count("out")
-        n_zeros = 0
-        for outcome, value in self.partial_results_table.items():
-            if value <= 0:
+            print("Updating ratings...")
+        self.update_ratings(suppress_output=suppress_output)
+
+    def record_history(self, directory: str = HISTORY_DIR, every='day'):
+        """Checkpoint every rating into a fresh RatingHistory while training, after each game day or every N games"""
+        self.history = RatingHistory.create(directory, self.player_ids, every)
+
+    def attach_history(self, directory: str = HISTORY_DIR):
+        """Continue recording into an existing RatingHistory, e.g. after EloModel.load for incremental training"""
+        self.history = RatingHistory(directory)
+        self.history.add_players(self.player_ids)
+
+    def checkpoint_offsets(self, chunk: PlayStore) -> np.ndarray:
+        """Offsets into a chunk of whole games after which the history takes a checkpoint
+
+            With every='day' that is after the last game of each day. A day that reaches the end of
+            the chunk is only known to be over at the next chunk, so its checkpoint comes at offset 0
+            of that chunk. With every N games the count runs on from the previous chunk or fit.
+        """
+        game_starts = chunk.game_bounds()[:-1]
+        if self.history.every == 'day':
+            game_dates = chunk.date[game_starts]
+            offsets = game_starts[np.flatnonzero(game_dates[1:] != game_dates[:-1]) + 1]
+            if self.trained_through is not None and chunk.date[0] != np.datetime64(self.trained_through[0], 'D'):
+                offsets = np.concatenate(([0], offsets))
+            return offsets
+        every, games_since = self.history.every, self.history.games_since_checkpoint
+        game_ends = np.append(game_starts[1:], len(chunk))
+        # game i of the chunk is game games_since + i + 1 since the last checkpoint
+        return game_ends[(games_since + np.arange(1, len(game_starts) + 1)) % every == 0]
+
+    def checkpoint(self):
+        """Add a checkpoint at the high-water mark, unless the history already has one there"""
+        if self.history.last_mark() != self.trained_through:
+            self.history.append(self.trained_through, self.player_ids, self.ratings, self.xp_counts)
+
+    def fit(self, plays, resume=False):
+        """Run the per-game Elo update over chronological plays, in memory only
+
+            plays is a PlayStore or an iterable of consecutive PlayStores that each hold whole games,
+            such as play_store.iter_play_stores. With resume=True the plays continue the previous fit,
+            so experience keeps counting from where it stopped. If a history is being recorded, the
+            ratings are checkpointed into it as the plays go by, and once more at the end of the plays.
+        """
+        chunks = [plays] if isinstance(plays, PlayStore) else plays
+        # otherwise experience is counted from zero on every pass, like the ratings it scales
+        if not resume:
+            self.xp_counts = [np.zeros(len(ids), dtype=np.int64) for ids in self.player_ids]
+            self.trained_through = None
+            if self.history is not None:
+                self.history = RatingHistory.create(self.history.directory, self.player_ids, self.history.every)
+        n_plays = self.xp_counts if self.use_xp else [None, None]
+
+        for chunk in chunks:
+            if not len(chunk):
                 continue
-            outcome_ind = self.results_as_integers[outcome]
-            try:
-                outcome_freq = pitcher.outcomes.get_outcome_count(outcome) / (pitcher.n_plays - n_outs)
-            except ZeroDivisionError:
-                outcome_freq = 0.25
-            outcome_freqs[outcome_ind] = outcome_freq * e_b
-            hit_value += value * outcome_freq
-        
-        return e_b * hit_value, e_b, outcome_freqs
+            scored = self.result_scores[chunk.result] != -1
+            plays = chunk.select(scored)
+            # indices, scores and blocks are worked out once per chunk, the checkpoints only cut the blocks
+            pitcher_index, batter_index = self.get_indices(plays.pitcherId, plays.batterId)
+            scores = self.result_scores[plays.result]
+            blocks = independent_blocks(pitcher_index, batter_index, plays.game_bounds())
+            # offsets into the scored plays of every offset into the chunk
+            scored_before = np.concatenate(([0], np.cumsum(scored)))
+            if self.history is None:
+                offsets = []
+            else:
+                if not len(self.history):
+                    # the ratings everything started from, as of the day before the first game
+                    self.history.append((chunk.date[0].item() - timedelta(days=1), 0), self.player_ids, self.ratings, self.xp_counts)
+                offsets = self.checkpoint_offsets(chunk).tolist()
+            bounds = [0] + offsets + [len(chunk)]
+            for i, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+                if end > start:
+                    self.trained_through = (chunk.date[end - 1].item(), int(chunk.gameId[end - 1]))
+                    first, last = int(scored_before[start]), int(scored_before[end])
+                    if last > first:
+                        segment_blocks = np.concatenate(([first], blocks[(blocks > first) & (blocks < last)], [last]))
+                        simulate_games(self.ratings[Position.PITCHER.value], self.ratings[Position.BATTER.value],
+                                       pitcher_index, batter_index, scores, segment_blocks, self.K, self.sigma, *n_plays)
+                # every segment but the last ends at a checkpoint offset
+                if i < len(offsets):
+                    self.checkpoint()
+            if self.history is not None and self.history.every != 'day':
+                self.history.games_since_checkpoint = (self.history.games_since_checkpoint + chunk.n_games()) % self.history.every
+
+        if self.history is not None and self.trained_through is not None:
+            # the ratings at the end of the plays, once, whatever the schedule
+            self.checkpoint()
+            self.history.save_meta()
+
+    def ratings_as_of(self, as_of, batch_size=10_000) -> list[np.ndarray]:
+        """Every rating as it stood before the games on date as_of, lined up with player_ids
+
+            Restores the last checkpoint of the recorded history before that date and replays only the
+            training games between the checkpoint and the date.
+        """
+        index = self.history.last_before(as_of)
+        if index == -1:
+            raise LookupError(f"No rating checkpoint before {as_of}")
+        model = self.copy()
+        model.history = None
+        model.ratings, model.xp_counts = self.history.row(index, self.player_ids)
+        dates, games = self.history.marks()
+        as_of = np.datetime64(as_of, 'D')
+        for chunk in iter_play_stores(self.session, True, batch_size, after=(dates[index].item(), int(games[index]))):
+            remainder = chunk.select(chunk.date < as_of)
+            model.fit(remainder, resume=True)
+            if len(remainder) < len(chunk):
+                break
+        return model.ratings
+
+    def train(self, suppress_output=True, batch_size=None, incremental=False):
+        """Train on the training split, write the ratings back and snapshot them
+
+            With incremental=True only the games after the model's high-water mark are played, starting
+            from its current ratings, e.g. EloModel.load(session).train(incremental=True) after a night's ingest.
+        """
+        after = None
+        if incremental:
+            # the ratings of a model built from the database already include the training split, replaying it would count it twice
+            if self.trained_through is None:
+                raise ValueError("Model has no high-water mark to train incrementally from, restore it with EloModel.load(session)")
+            self.add_new_players()
+            after = self.trained_through
+        self.simulate_elo(suppress_output=suppress_output, batch_size=batch_size, after=after)
+        self.save_snapshot()
+        if not suppress_output:
+            print(f"Saved rating snapshot {self.snapshot_id}")
+
+    def calculate_ev(self, pitcher_index, batter_index):
+        """Expected partial value, hit probability and per-hit-type probabilities of a matchup
 
+            Takes scalar or array indices into the rating arrays, so the outcome probabilities are
+            either a vector or an (N x n_hit_types) matrix
+        """
+        e_b = expected_scores(self.ratings[Position.BATTER.value][batter_index], self.ratings[Position.PITCHER.value][pitcher_index], self.sigma)
+        # given the probability of a hit, the expected value is that probability times the expected value of a hit
+        e_b = np.asarray(e_b)
+        return e_b * self.hit_values[pitcher_index], e_b, e_b[..., np.newaxis] * self.outcome_freqs[pitcher_index]
 
     def predict_partial(self, play: Play):
-        pitcher = self.player_tables[Position.PITCHER.value][play.pitcherId]
-        batter = self.player_tables[Position.BATTER.value][play.batterId]
-        pitcher_rating = pitcher.rating.value
-        batter_rating = batter.rating.value
+        pitcher_index = self.player_index[Position.PITCHER.value][play.pitcherId]
+        batter_index = self.player_index[Position.BATTER.value][play.batterId]
 
-        e_b = self.calculate_ev(batter_rating, pitcher_rating, pitcher, batter, play)
-        return e_b
+        partial_ev, _, _ = self.calculate_ev(pitcher_index, batter_index)
+        return float(partial_ev)
 
     def predict(self, play: Play):
-        pitcher = self.player_tables[Position.PITCHER.value][play.pitcherId]
-        batter = self.player_tables[Position.BATTER.value][play.batterId]
         # pitcher_rating = pitcher.rating.value
         # batter_rating = batter.rating.value
-        pitcher_rating = self.ratings_tables[Position.PITCHER.value][play.pitcherId]
-        batter_rating = self.ratings_tables[Position.BATTER.value][play.batterId]
+        pitcher_rating = self.get_rating(play.pitcherId, Position.PITCHER)
+        batter_rating = self.get_rating(play.batterId, Position.BATTER)
 
-        e_b = calculate_ev(batter_rating, pitcher_rating)
+        e_b = float(expected_scores(batter_rating, pitcher_rating, self.sigma))
         prediction = e_b 
 
-        self.simulate_play(play)
-
         return prediction
     
     def predict_partial_outcomes(self, play: Play) -> tuple[float, list[float]]:
-        pitcher = self.player_tables[Position.PITCHER.value][play.pitcherId]
-        batter = self.player_tables[Position.BATTER.value][play.batterId]
-        # pitcher_rating = pitcher.rating.value
-        # batter_rating = batter.rating.value
-        pitcher_rating = self.ratings_tables[Position.PITCHER.value][play.pitcherId]
-        batter_rating = self.ratings_tables[Position.BATTER.value][play.batterId]
-
-        e_b, hit_prob, partial_probs = self.calculate_ev(batter_rating, pitcher_rating, pitcher, batter, play)
-        prediction = e_b
-        outcome_probs = [1-hit_prob]
-        outcome_probs.extend(partial_probs.values())
+        pitcher_index = self.player_index[Position.PITCHER.value][play.pitcherId]
+        batter_index = self.player_index[Position.BATTER.value][play.batterId]
 
-        self.simulate_play(play)
+        partial_ev, hit_prob, partial_probs = self.calculate_ev(pitcher_index, batter_index)
+        prediction = float(partial_ev)
+        outcome_probs = [1 - float(hit_prob)]
+        outcome_probs.extend(partial_probs.tolist())
 
         return prediction, outcome_probs
+
+    def predict_many(self, pitcher_ids, batter_ids) -> np.ndarray:
+        """Batched predict over arrays of player ids, without updating any ratings"""
+        pitcher_index, batter_index = self.get_indices(pitcher_ids, batter_ids)
+        return expected_scores(self.ratings[Position.BATTER.value][batter_index], self.ratings[Position.PITCHER.value][pitcher_index], self.sigma)
+
+    def predict_outcomes_many(self, pitcher_ids, batter_ids) -> tuple[np.ndarray, np.ndarray]:
+        """Batched predict_partial_outcomes over arrays of player ids, without updating any ratings
+
+            returns: (partial_predictions, outcome_probs) with outcome_probs an (N x 5) matrix
+        """
+        pitcher_index, batter_index = self.get_indices(pitcher_ids, batter_ids)
+
+        partial_ev, hit_prob, partial_probs = self.calculate_ev(pitcher_index, batter_index)
+        return partial_ev, np.column_stack((1 - hit_prob, partial_probs))
     
+    def update(self, play: Play):
+        self.simulate_play(play)
+
+    def replay_many(self, plays: PlayStore) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        pitcher_index, batter_index = self.get_indices(plays.pitcherId, plays.batterId)
+        hit = replay_plays(self.ratings[Position.PITCHER.value], self.ratings[Position.BATTER.value],
+                           pitcher_index, batter_index, self.result_scores[plays.result], self.K, self.sigma)
+        partial = hit * self.hit_values[pitcher_index]
+        outcomes = np.column_stack((1 - hit, hit[:, np.newaxis] * self.outcome_freqs[pitcher_index]))
+        return hit, partial, outcomes
+
+    def __getstate__(self):
+        # a session cannot cross process boundaries, an unpickled model can predict and replay but not persist
+        state = self.__dict__.copy()
+        state['session'] = None
+        return state
+
+    def copy(self):
+        """A copy with its own ratings and counts, so replaying or fitting plays on it leaves this model untouched"""
+        model = copy.copy(self)
+        # copy.copy goes through __getstate__, but a copy in the same process can keep using the session
+        model.session = self.session
+        model.ratings = [ratings.copy() for ratings in self.ratings]
+        model.xp_counts = [counts.copy() for counts in self.xp_counts]
+        model.stored_ratings = [ratings.copy() for ratings in self.stored_ratings]
+        return model
+
     def simulate_play(self, play: Play):
-        pitcher: Pitcher = self.player_tables[Position.PITCHER.value][play.pitcherId]
+        pitcher_index = self.player_index[Position.PITCHER.value][play.pitcherId]
+        batter_index = self.player_index[Position.BATTER.value][play.batterId]
 
-        pitcher_rating = self.ratings_tables[Position.PITCHER.value][play.pitcherId]
-        batter_rating = self.ratings_tables[Position.BATTER.value][play.batterId]
+        pitcher_rating = self.ratings[Position.PITCHER.value][pitcher_index]
+        batter_rating = self.ratings[Position.BATTER.value][batter_index]
 
-        e_b = calculate_ev(batter_rating, pitcher_rating)
+        e_b = float(expected_scores(batter_rating, pitcher_rating, self.sigma))
         e_p = 1 - e_b
 
-        s_b = self.results_table[play.result]
+        s_b = self.result_scores[play.resultCode]
+        if s_b == -1:
+            return
         s_p = 1 - s_b
 
         # pitcher.outcomes.increment_outcome_count(play.result)
@@ -224,13 +546,13 @@ class EloModel:
         # xp_factor = calculate_xp(self.ratings_tables[Position.PITCHER.values][play.pitcher_id])
         xp_factor = 1
         change = self.K * (s_p - e_p) * xp_factor
-        self.ratings_tables[Position.PITCHER.value][play.pitcherId] += change
+        self.ratings[Position.PITCHER.value][pitcher_index] += change
         # xp_factor = calculate_xp(self.ratings_tables[Position.BATTER.values][play.batter_id])
         xp_factor = 1
         change = self.K * (s_b - e_b) * xp_factor
-        self.ratings_tables[Position.BATTER.value][play.batterId] += change
+        self.ratings[Position.BATTER.value][batter_index] += change
     
-class DumbModel:
+class DumbModel(PredictionModel):
     def __init__(self):
         pass
 
@@ -243,7 +565,13 @@ class DumbModel:
     def predict_partial_outcomes(self, play):
         return 0.0,  [0.96, 0.01, 0.01, 0.01, 0.01]
 
-class RandomModel:
+    def predict_many(self, pitcher_ids, batter_ids):
+        return np.zeros(len(pitcher_ids))
+
+    def predict_outcomes_many(self, pitcher_ids, batter_ids):
+        return np.zeros(len(pitcher_ids)), np.tile([0.96, 0.01, 0.01, 0.01, 0.01], (len(pitcher_ids), 1))
+
+class RandomModel(PredictionModel):
     def __init__(self):
         pass
 
@@ -260,4 +588,10 @@ class RandomModel:
             new_val = random.uniform(0, total)
             outcomes.append(new_val)
             total -= new_val
-        return random.random(), [random.random() for i in range(5)]
\ No newline at end of file
+        return random.random(), [random.random() for i in range(5)]
+
+    def predict_many(self, pitcher_ids, batter_ids):
+        return np.random.randint(0, 2, len(pitcher_ids)).astype(np.float64)
+
+    def predict_outcomes_many(self, pitcher_ids, batter_ids):
+        return np.random.random(len(pitcher_ids)), np.random.random((len(pitcher_ids), 5))
\ No newline at end of file
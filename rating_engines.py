@@ -0,0 +1,267 @@
+import copy
+import sys
+from abc import abstractmethod
+
+import numpy as np
+
+from db_utils import create_session_scope
+from elo_engine import expected_scores, independent_blocks, position_indices, simulate_games
+from evaluation import evaluate_models, write_report
+from models import Position
+from play_store import PlayStore, load_play_store, RESULTS
+from prediction_model import PredictionModel, EloModel, results_table
+from utils import SIGMA, INITIAL_RATING
+
+# Glicko-2 works on its own scale, rating = GLICKO_SCALE * mu + INITIAL_RATING
+GLICKO_SCALE = 173.7178
+
+
+class PlayerState:
+    """Per-player arrays shared by the rating engines
+
+        Every quantity an engine tracks (rating, deviation, ...) is a list of two arrays lined up with
+        player_ids, which lines up with the Position enum.
+    """
+
+    def __init__(self, player_ids: list[np.ndarray], **values: list[np.ndarray]):
+        self.player_ids = player_ids
+        self.values = values
+
+    def __getitem__(self, name: str) -> list[np.ndarray]:
+        return self.values[name]
+
+    def get_indices(self, pitcher_ids, batter_ids):
+        """Positions of the given pitcher and batter ids in the state arrays"""
+        return position_indices(self.player_ids, pitcher_ids, batter_ids)
+
+    def copy(self) -> 'PlayerState':
+        return PlayerState(self.player_ids, **{name: [array.copy() for array in arrays] for name, arrays in self.values.items()})
+
+
+class RatingEngine:
+    """How ratings predict a matchup and how one rating period of plays updates them
+
+        A rating period is one game: every play in it is predicted from the ratings at the start of the
+        game and the players who took part are updated together at its end.
+    """
+
+    @abstractmethod
+    def initial_state(self, player_ids: list[np.ndarray]) -> PlayerState:
+        pass
+
+    @abstractmethod
+    def expected(self, state: PlayerState, pitcher_index: np.ndarray, batter_index: np.ndarray) -> np.ndarray:
+        """The batter's expected score in each matchup"""
+        pass
+
+    @abstractmethod
+    def update_period(self, state: PlayerState, pitcher_index: np.ndarray, batter_index: np.ndarray, scores: np.ndarray):
+        """Apply one rating period of plays to the state in place, scores are the batter's"""
+        pass
+
+    def fit(self, state: PlayerState, pitcher_index: np.ndarray, batter_index: np.ndarray, scores: np.ndarray, game_bounds: np.ndarray):
+        """Play every game in order, game i spans plays [game_bounds[i], game_bounds[i+1])"""
+        for start, end in zip(game_bounds[:-1].tolist(), game_bounds[1:].tolist()):
+            self.update_period(state, pitcher_index[start:end], batter_index[start:end], scores[start:end])
+
+
+class EloEngine(RatingEngine):
+    """The per-game Elo update of elo_engine.simulate_games"""
+
+    def __init__(self, K: float = 16, sigma: float = SIGMA):
+        self.K = K
+        self.sigma = sigma
+
+    def initial_state(self, player_ids):
+        return PlayerState(player_ids, rating=[np.full(len(ids), INITIAL_RATING, dtype=np.float64) for ids in player_ids])
+
+    def expected(self, state, pitcher_index, batter_index):
+        return expected_scores(state['rating'][Position.BATTER.value][batter_index], state['rating'][Position.PITCHER.value][pitcher_index], self.sigma)
+
+    def update_period(self, state, pitcher_index, batter_index, scores):
+        self.fit(state, pitcher_index, batter_index, scores, np.array([0, len(scores)]))
+
+    def fit(self, state, pitcher_index, batter_index, scores, game_bounds):
+        simulate_games(state['rating'][Position.PITCHER.value], state['rating'][Position.BATTER.value],
+                       pitcher_index, batter_index, scores, independent_blocks(pitcher_index, batter_index, game_bounds),
+                       self.K, self.sigma)
+
+
+def _g(phi):
+    return 1 / np.sqrt(1 + 3 * phi ** 2 / np.pi ** 2)
+
+
+class Glicko2Engine(RatingEngine):
+    """Glicko-2 (Glickman 2012) with one game per rating period, vectorized over the players in the game
+
+        Only players who appear in a period are updated, the deviation of everyone else is left alone,
+        since a game is far shorter than the period the system's volatility was designed around.
+    """
+
+    def __init__(self, tau: float = 0.5, initial_deviation: float = 350, initial_volatility: float = 0.06,
+                 epsilon: float = 1e-6, max_iterations: int = 100):
+        self.tau = tau
+        self.initial_deviation = initial_deviation
+        self.initial_volatility = initial_volatility
+        self.epsilon = epsilon
+        self.max_iterations = max_iterations
+
+    def initial_state(self, player_ids):
+        return PlayerState(
+            player_ids,
+            mu=[np.zeros(len(ids)) for ids in player_ids],
+            phi=[np.full(len(ids), self.initial_deviation / GLICKO_SCALE) for ids in player_ids],
+            volatility=[np.full(len(ids), self.initial_volatility) for ids in player_ids],
+        )
+
+    def expected(self, state, pitcher_index, batter_index):
+        mu_b = state['mu'][Position.BATTER.value][batter_index]
+        mu_p = state['mu'][Position.PITCHER.value][pitcher_index]
+        phi_p = state['phi'][Position.PITCHER.value][pitcher_index]
+        return 1 / (1 + np.exp(-_g(phi_p) * (mu_b - mu_p)))
+
+    def new_volatility(self, phi, volatility, v, delta):
+        """Step 5 of Glicko-2, the Illinois iteration run on every participant at once"""
+        a = np.log(volatility ** 2)
+        tau2 = self.tau ** 2
+
+        def f(x):
+            ex = np.exp(x)
+            return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau2
+
+        A = a.copy()
+        large = delta ** 2 > phi ** 2 + v
+        B = np.where(large, np.log(np.maximum(delta ** 2 - phi ** 2 - v, np.finfo(np.float64).tiny)), a - self.tau)
+        # step B down until f changes sign for the players whose bracket is not known yet
+        pending = ~large & (f(B) < 0)
+        while pending.any():
+            B[pending] -= self.tau
+            pending &= f(B) < 0
+
+        fA, fB = f(A), f(B)
+        for _ in range(self.max_iterations):
+            active = np.abs(B - A) > self.epsilon
+            if not active.any():
+                break
+            C = A + (A - B) * fA / (fB - fA)
+            fC = f(C)
+            crossed = fC * fB <= 0
+            A = np.where(active & crossed, B, A)
+            fA = np.where(active, np.where(crossed, fB, fA / 2), fA)
+            B = np.where(active, C, B)
+            fB = np.where(active, fC, fB)
+        return np.exp(A / 2)
+
+    def update_period(self, state, pitcher_index, batter_index, scores):
+        sides = (
+            # (position, own index, opponent position, opponent index, own score)
+            (Position.BATTER, batter_index, Position.PITCHER, pitcher_index, scores),
+            (Position.PITCHER, pitcher_index, Position.BATTER, batter_index, 1 - scores),
+        )
+        # both sides are computed from the ratings at the start of the period before either is written
+        updates = []
+        for position, own, opponent_position, opponent, own_scores in sides:
+            mu, phi = state['mu'][position.value], state['phi'][position.value]
+            g = _g(state['phi'][opponent_position.value][opponent])
+            e = 1 / (1 + np.exp(-g * (mu[own] - state['mu'][opponent_position.value][opponent])))
+
+            players, inverse = np.unique(own, return_inverse=True)
+            v_inverse = np.bincount(inverse, weights=g ** 2 * e * (1 - e), minlength=len(players))
+            score_sum = np.bincount(inverse, weights=g * (own_scores - e), minlength=len(players))
+            v = 1 / v_inverse
+
+            volatility = self.new_volatility(phi[players], state['volatility'][position.value][players], v, v * score_sum)
+            phi_star = np.sqrt(phi[players] ** 2 + volatility ** 2)
+            new_phi = 1 / np.sqrt(1 / phi_star ** 2 + 1 / v)
+            updates.append((position, players, mu[players] + new_phi ** 2 * score_sum, new_phi, volatility))
+
+        for position, players, new_mu, new_phi, volatility in updates:
+            state['mu'][position.value][players] = new_mu
+            state['phi'][position.value][players] = new_phi
+            state['volatility'][position.value][players] = volatility
+
+    @staticmethod
+    def ratings(state: PlayerState) -> list[np.ndarray]:
+        """Ratings on the familiar 1500-centred scale"""
+        return [GLICKO_SCALE * mu + INITIAL_RATING for mu in state['mu']]
+
+
+class RatingEngineModel(PredictionModel):
+    """A PredictionModel over any RatingEngine, with hit types split by the pitcher's outcome frequencies like EloModel"""
+
+    def __init__(self, engine: RatingEngine, player_ids: list[np.ndarray], hit_values: np.ndarray, outcome_freqs: np.ndarray,
+                 results_table=results_table):
+        self.engine = engine
+        self.state = engine.initial_state(player_ids)
+        self.hit_values = hit_values
+        self.outcome_freqs = outcome_freqs
+        self.result_scores = np.array([results_table[result] for result in RESULTS], dtype=np.float64)
+
+    @classmethod
+    def like(cls, model: EloModel, engine: RatingEngine) -> 'RatingEngineModel':
+        """An untrained engine model over the same players, outcome frequencies and results table as an EloModel"""
+        return cls(engine, model.player_ids, model.hit_values, model.outcome_freqs, model.results_table)
+
+    def fit(self, plays: PlayStore):
+        plays = plays.select(self.result_scores[plays.result] != -1)
+        pitcher_index, batter_index = self.state.get_indices(plays.pitcherId, plays.batterId)
+        self.engine.fit(self.state, pitcher_index, batter_index, self.result_scores[plays.result], plays.game_bounds())
+
+    def train(self):
+        with create_session_scope() as session:
+            self.fit(load_play_store(session, training=True))
+
+    def outcomes(self, pitcher_index, hit):
+        return hit * self.hit_values[pitcher_index], np.column_stack((1 - hit, hit[:, np.newaxis] * self.outcome_freqs[pitcher_index]))
+
+    def predict_many(self, pitcher_ids, batter_ids):
+        return self.engine.expected(self.state, *self.state.get_indices(pitcher_ids, batter_ids))
+
+    def predict_outcomes_many(self, pitcher_ids, batter_ids):
+        pitcher_index, batter_index = self.state.get_indices(pitcher_ids, batter_ids)
+        return self.outcomes(pitcher_index, self.engine.expected(self.state, pitcher_index, batter_index))
+
+    def predict(self, play):
+        return float(self.predict_many([play.pitcherId], [play.batterId])[0])
+
+    def predict_partial(self, play):
+        return self.predict_partial_outcomes(play)[0]
+
+    def predict_partial_outcomes(self, play):
+        partial, outcomes = self.predict_outcomes_many([play.pitcherId], [play.batterId])
+        return float(partial[0]), outcomes[0].tolist()
+
+    def replay_many(self, plays: PlayStore):
+        """Predict each game from the state at its start, then apply the game as one rating period"""
+        pitcher_index, batter_index = self.state.get_indices(plays.pitcherId, plays.batterId)
+        scores = self.result_scores[plays.result]
+        hit = np.empty(len(plays))
+        bounds = plays.game_bounds()
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            hit[start:end] = self.engine.expected(self.state, pitcher_index[start:end], batter_index[start:end])
+            scored = scores[start:end] != -1
+            if scored.any():
+                self.engine.update_period(self.state, pitcher_index[start:end][scored], batter_index[start:end][scored], scores[start:end][scored])
+        return (hit, *self.outcomes(pitcher_index, hit))
+
+    def copy(self):
+        model = copy.copy(self)
+        model.state = self.state.copy()
+        return model
+
+
+def main():
+    # compare the engines trained from scratch on the training split: python rating_engines.py [report.json]
+    with create_session_scope() as session:
+        elo = EloModel(session)
+        training_plays = load_play_store(session, training=True)
+        testing_plays = load_play_store(session, training=False)
+
+    models = {name: RatingEngineModel.like(elo, engine) for name, engine in (("Elo", EloEngine(elo.K, elo.sigma)), ("Glicko-2", Glicko2Engine()))}
+    for model in models.values():
+        model.fit(training_plays)
+    write_report(evaluate_models(models, testing_plays), sys.argv[1] if len(sys.argv) > 1 else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import json
+import os
+
+import numpy as np
+
+from models import Position
+from utils import INITIAL_RATING
+
+HISTORY_DIR = 'data/rating_history'
+
+
+class RatingHistory:
+    """Append-only rating checkpoints: a float32 matrix with one row per checkpoint and one column per player
+
+        Each row holds every rating right after the games up to its (date, gameId) mark were played, so
+        a rating as of any date is the last row marked before it plus the games since. Rows are appended
+        to flat binary files and read back through np.memmap, a checkpoint costs one write of 4 bytes
+        per player. Columns are never reordered, players added later get new columns.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(self.path('meta.json')) as f:
+            meta = json.load(f)
+        self.every = meta['every']
+        # games played since the last checkpoint taken every N games, carried across chunks and fits
+        self.games_since_checkpoint = meta.get('games_since_checkpoint', 0)
+        self.column_ids = np.load(self.path('column_ids.npy'))
+        self.column_positions = np.load(self.path('column_positions.npy'))
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @classmethod
+    def create(cls, directory: str, player_ids, every='day') -> 'RatingHistory':
+        """Start an empty history over the players in player_ids (lines up with Position enum)
+
+            every is 'day' for a checkpoint after each game day or an int for one every that many games
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'column_ids.npy'), np.concatenate(player_ids))
+        np.save(os.path.join(directory, 'column_positions.npy'),
+                np.concatenate([np.full(len(ids), position.value, dtype=np.int8) for position, ids in zip(Position, player_ids)]))
+        for name in ('dates.bin', 'games.bin', 'ratings.bin', 'xp_counts.bin'):
+            open(os.path.join(directory, name), 'wb').close()
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'every': every}, f)
+        return cls(directory)
+
+    def save_meta(self):
+        with open(self.path('meta.json'), 'w') as f:
+            json.dump({'every': self.every, 'games_since_checkpoint': self.games_since_checkpoint}, f)
+
+    def __len__(self):
+        return os.path.getsize(self.path('dates.bin')) // 8
+
+    def columns(self, player_ids) -> list[np.ndarray]:
+        """Column of each player in player_ids (lines up with Position enum), -1 for players the history lacks"""
+        columns = []
+        for position, ids in zip(Position, player_ids):
+            position_columns = np.flatnonzero(self.column_positions == position.value)
+            order = np.argsort(self.column_ids[position_columns])
+            sorted_ids = self.column_ids[position_columns][order]
+            found = np.searchsorted(sorted_ids, ids)
+            found[found == len(sorted_ids)] = 0
+            columns.append(np.where(sorted_ids[found] == ids, position_columns[order][found], -1) if len(sorted_ids) else np.full(len(ids), -1))
+        return columns
+
+    def add_players(self, player_ids):
+        """Give players that are not in the history yet their own columns, rewriting the existing rows once
+
+            They are filled in at INITIAL_RATING with no experience, which is where they stood before their first game.
+        """
+        new_ids, new_positions = [], []
+        for position, ids, columns in zip(Position, player_ids, self.columns(player_ids)):
+            new_ids.append(ids[columns == -1])
+            new_positions.append(np.full(np.count_nonzero(columns == -1), position.value, dtype=np.int8))
+        n_new = sum(len(ids) for ids in new_ids)
+        if not n_new:
+            return 0
+
+        n_rows, width = len(self), len(self.column_ids)
+        for name, dtype, fill in (('ratings.bin', np.float32, INITIAL_RATING), ('xp_counts.bin', np.int32, 0)):
+            rows = np.fromfile(self.path(name), dtype=dtype).reshape(n_rows, width)
+            np.hstack((rows, np.full((n_rows, n_new), fill, dtype=dtype))).tofile(self.path(name))
+        self.column_ids = np.concatenate([self.column_ids, *new_ids])
+        self.column_positions = np.concatenate([self.column_positions, *new_positions])
+        np.save(self.path('column_ids.npy'), self.column_ids)
+        np.save(self.path('column_positions.npy'), self.column_positions)
+        return n_new
+
+    def append(self, mark, player_ids, ratings, xp_counts):
+        """Add a checkpoint row after the game mark = (date, gameId), the arrays line up with player_ids"""
+        row = np.full(len(self.column_ids), INITIAL_RATING, dtype=np.float32)
+        xp_row = np.zeros(len(self.column_ids), dtype=np.int32)
+        for columns, values, counts in zip(self.columns(player_ids), ratings, xp_counts):
+            row[columns] = values
+            xp_row[columns] = counts
+        with open(self.path('dates.bin'), 'ab') as f:
+            f.write(np.array([np.datetime64(mark[0], 'D').astype(np.int64)], dtype=np.int64).tobytes())
+        with open(self.path('games.bin'), 'ab') as f:
+            f.write(np.array([mark[1]], dtype=np.int64).tobytes())
+        with open(self.path('ratings.bin'), 'ab') as f:
+            f.write(row.tobytes())
+        with open(self.path('xp_counts.bin'), 'ab') as f:
+            f.write(xp_row.tobytes())
+
+    def marks(self):
+        """(dates, gameIds) of every checkpoint, in the order they were taken"""
+        n_rows = len(self)
+        return (np.fromfile(self.path('dates.bin'), dtype=np.int64, count=n_rows).astype('datetime64[D]'),
+                np.fromfile(self.path('games.bin'), dtype=np.int64, count=n_rows))
+
+    def last_mark(self):
+        """(date, gameId) of the latest checkpoint, None for an empty history"""
+        if not len(self):
+            return None
+        dates, games = self.marks()
+        return dates[-1].item(), int(games[-1])
+
+    def last_before(self, date) -> int:
+        """Index of the last checkpoint taken after games strictly before date, -1 if there is none"""
+        dates, _ = self.marks()
+        return int(np.searchsorted(dates, np.datetime64(date, 'D'), side='left')) - 1
+
+    def ratings_before(self, dates, player_ids) -> list[np.ndarray]:
+        """Each player's rating at the last checkpoint taken before the matching date
+
+            dates and every array of player_ids (lines up with Position enum) run in parallel, e.g. a
+            PlayStore's date, pitcherId and batterId. Players the history lacks, or dates before its
+            first checkpoint, get INITIAL_RATING.
+        """
+        marks, _ = self.marks()
+        rows = np.searchsorted(marks, np.asarray(dates, dtype='datetime64[D]'), side='left') - 1
+        before = []
+        for columns in self.columns(player_ids):
+            values = np.full(len(rows), INITIAL_RATING, dtype=np.float64)
+            known = (rows >= 0) & (columns >= 0)
+            if known.any():
+                ratings = np.memmap(self.path('ratings.bin'), dtype=np.float32, mode='r', shape=(len(self), len(self.column_ids)))
+                values[known] = ratings[rows[known], columns[known]]
+            before.append(values)
+        return before
+
+    def row(self, index: int, player_ids):
+        """Ratings and experience counts at checkpoint index, as arrays lined up with player_ids"""
+        width = len(self.column_ids)
+        ratings = np.memmap(self.path('ratings.bin'), dtype=np.float32, mode='r', shape=(len(self), width))
+        xp_counts = np.memmap(self.path('xp_counts.bin'), dtype=np.int32, mode='r', shape=(len(self), width))
+        rows = []
+        for columns in self.columns(player_ids):
+            missing = columns == -1
+            rows.append((np.where(missing, INITIAL_RATING, ratings[index, columns]).astype(np.float64),
+                         np.where(missing, 0, xp_counts[index, columns]).astype(np.int64)))
+        return [ratings for ratings, _ in rows], [counts for _, counts in rows]
@@ -0,0 +1,162 @@
+import hashlib
+import itertools
+import json
+import os
+import random
+import sys
+from collections import namedtuple
+
+from db_utils import create_session_scope
+from evaluation import evaluate
+from parallel_evaluation import shared_plays_pool, worker_state
+from play_store import PlayStore, load_play_store
+from prediction_model import EloModel, make_results_table, partial_results_table
+from utils import basic_func, linear_func, quadratic_func, logistic_func
+
+SWEEP_CACHE_DIR = 'data/sweep_cache'
+LEADERBOARD_FILE = 'data/sweep_leaderboard.json'
+
+RESULTS_FUNCS = {
+    'basic': basic_func,
+    'linear': linear_func,
+    'quadratic': quadratic_func,
+    'logistic': logistic_func,
+}
+
+PARTIAL_RESULTS_TABLES = {
+    'default': partial_results_table,
+}
+
+SweepConfig = namedtuple('SweepConfig', ['K', 'sigma', 'results_func', 'partial_results_table', 'use_xp'])
+
+# lists are searched exhaustively, (low, high) tuples are sampled uniformly by random_search
+DEFAULT_SPACE = {
+    'K': [4, 8, 16, 24, 32],
+    'sigma': [200, 300, 400, 600, 800],
+    'results_func': ['basic'],
+    'partial_results_table': ['default'],
+    'use_xp': [False, True],
+}
+
+
+def grid_search(space: dict) -> list[SweepConfig]:
+    return [SweepConfig(*values) for values in itertools.product(*(space[field] for field in SweepConfig._fields))]
+
+
+def random_search(space: dict, n: int, seed: int = None) -> list[SweepConfig]:
+    rng = random.Random(seed)
+
+    def sample(values):
+        if isinstance(values, tuple):
+            return rng.uniform(*values)
+        return rng.choice(values)
+
+    return [SweepConfig(*(sample(space[field]) for field in SweepConfig._fields)) for _ in range(n)]
+
+
+def training_key(config: SweepConfig):
+    # the partial results table only changes evaluation, so configs differing in it share one training run
+    return config.K, config.sigma, config.results_func, config.use_xp
+
+
+def data_fingerprint(model: EloModel, training_plays: PlayStore, testing_plays: PlayStore) -> str:
+    digest = hashlib.sha1()
+    for array in [*model.player_ids, *model.ratings, model.pitcher_outcome_counts]:
+        digest.update(array.tobytes())
+    for plays in (training_plays, testing_plays):
+        for column in PlayStore.columns:
+            digest.update(getattr(plays, column).tobytes())
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir: str, fingerprint: str, config: SweepConfig) -> str:
+    key = hashlib.sha1(json.dumps([fingerprint, list(config)]).encode()).hexdigest()
+    return os.path.join(cache_dir, key + '.json')
+
+
+def _run_group(configs: list[SweepConfig]):
+    """Train once for the shared training parameters, then evaluate every config of the group"""
+    first = configs[0]
+    partial_results_tables = worker_state['partial_results_tables']
+    results_table = make_results_table(RESULTS_FUNCS[first.results_func])
+
+    model = worker_state['base_model'].copy()
+    model.K, model.sigma, model.use_xp = first.K, first.sigma, first.use_xp
+    model.set_results_tables(results_table, partial_results_tables[first.partial_results_table])
+    model.fit(worker_state['training_plays'])
+
+    results = []
+    for config in configs:
+        partial_table = partial_results_tables[config.partial_results_table]
+        model.set_results_tables(results_table, partial_table)
+        model.set_outcome_counts(model.pitcher_n_plays, model.pitcher_outcome_counts)
+        results.append((config, evaluate(model, worker_state['testing_plays'], results_table, partial_table)))
+    return results
+
+
+def run_sweep(configs: list[SweepConfig], base_model: EloModel, training_plays: PlayStore, testing_plays: PlayStore,
+              metric: str = 'long_term_inaccuracy', max_workers: int = None, cache_dir: str = SWEEP_CACHE_DIR,
+              partial_results_tables: dict = PARTIAL_RESULTS_TABLES) -> list[dict]:
+    """Train and evaluate every configuration in a process pool, returns the leaderboard ranked by metric (lower is better)
+
+        Every config starts from base_model's ratings. Workers share memory-mapped copies of the plays,
+        and finished configurations are cached on disk so that rerunning a sweep only computes new ones.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    fingerprint = data_fingerprint(base_model, training_plays, testing_plays)
+
+    results = {}
+    for config in set(configs):
+        path = cache_path(cache_dir, fingerprint, config)
+        if os.path.exists(path):
+            with open(path) as f:
+                results[config] = json.load(f)['metrics']
+
+    groups = {}
+    for config in set(configs) - set(results):
+        groups.setdefault(training_key(config), []).append(config)
+
+    if groups:
+        stores = {'training_plays': training_plays, 'testing_plays': testing_plays}
+        shared = {'base_model': base_model, 'partial_results_tables': partial_results_tables}
+        with shared_plays_pool(stores, shared, max_workers) as pool:
+            for group_results in pool.map(_run_group, groups.values()):
+                for config, metrics in group_results:
+                    results[config] = metrics
+                    with open(cache_path(cache_dir, fingerprint, config), 'w') as f:
+                        json.dump({'config': config._asdict(), 'metrics': metrics}, f)
+
+    ranked = sorted(results.items(), key=lambda item: item[1][metric])
+    return [{'rank': rank, **config._asdict(), **metrics} for rank, (config, metrics) in enumerate(ranked, start=1)]
+
+
+def write_leaderboard(leaderboard: list[dict], path: str = LEADERBOARD_FILE, metric: str = 'long_term_inaccuracy', top: int = 10):
+    with open(path, 'w') as f:
+        json.dump(leaderboard, f, indent=4)
+    for row in leaderboard[:top]:
+        print(f"{row['rank']:>4}. K={row['K']:<8.4g} sigma={row['sigma']:<8.4g} results={row['results_func']:<10} "
+              f"partial={row['partial_results_table']:<10} xp={row['use_xp']!s:<6} {metric}={row[metric]:.6f}")
+
+
+def main():
+    # usage: python sweep.py [grid | random N]
+    if len(sys.argv) > 2 and sys.argv[1] == 'random':
+        space = dict(DEFAULT_SPACE, K=(1, 48), sigma=(100, 1000))
+        configs = random_search(space, int(sys.argv[2]))
+    else:
+        configs = grid_search(DEFAULT_SPACE)
+
+    with create_session_scope() as session:
+        base_model = EloModel(session)
+        training_plays = load_play_store(session, training=True)
+        testing_plays = load_play_store(session, training=False)
+    # the database holds the ratings of the last training run, every config trains from scratch
+    base_model.reset_ratings()
+
+    print(f"Sweeping {len(configs)} configurations...")
+    leaderboard = run_sweep(configs, base_model, training_plays, testing_plays)
+    write_leaderboard(leaderboard)
+
+
+if __name__ == "__main__":
+    main()
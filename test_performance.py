@@ -1,204 +1,100 @@
 import sys
-from sklearn.metrics import log_loss
-import numpy as np
-
-from models import Pitcher, Batter, Play
-from utils import calculate_ev
-from db_utils import create_session_scope, get_all_plays
-from prediction_model import PredictionModel, EloModel, DumbModel, RandomModel, results_table, partial_results_table
-from progressbar import progressbar
-
-def test_partial_pbp(model: PredictionModel, session, results_table=partial_results_table):
-    """Test the play by play accuracy of the model
-    
-        returns: (wrong_predictions, n_plays, total_outcome)
-    """     
-
-    wrong_predictions = 0
-    n_plays = 0
-    total_outcome = 0.0
-
-    for play in progressbar(get_all_plays(session, training=False)):
-        result = play.result
-        # only test plays that are not outs
-        if result != 'DNS': 
-            prediction, outcomes = model.predict_partial_outcomes(play)
-            # print(prediction) # prediction is in terms of expected batter wins
-            observed = results_table[result] 
-
-            if observed != -1:
-                total_outcome += observed
-                if observed != prediction:
-                    wrong_predictions += 1
-                n_plays += 1
-                total_outcome += observed
-        
-    return wrong_predictions, n_plays, total_outcome
-
-def test_partial_lt(model: PredictionModel, session, results_table=partial_results_table):
-    """ Test how accurate the model is at projecting long-term outcomes """
-    total_wins = 0
-    expected_wins = 0
-    n_plays = 0
-
-    testing_plays = get_all_plays(session, training=False)
-
-    for play in progressbar(testing_plays):
-        result = play.result
-        # only test plays that are not outs
-        prediction, _ = model.predict_partial_outcomes(play)
-        # print(prediction)
-        observed = results_table[result] 
-        if observed != -1:
-            total_wins += observed
-            expected_wins += prediction
-            n_plays += 1
-        
-    return total_wins, expected_wins, n_plays
-
-def test_lt(model: PredictionModel, session, results_table=results_table):
-    """ Test how accurate the model is at projecting long-term outcomes """
-    total_wins = 0
-    expected_wins = 0
-    n_plays = 0
-
-    testing_plays = get_all_plays(session, training=False)
-
-    for play in progressbar(testing_plays):
-        prediction = model.predict(play)
-        result = play.result
-        observed = results_table[result] 
-        if observed != -1:
-            total_wins += observed
-            expected_wins += prediction
-            n_plays += 1
-        
-    return total_wins, expected_wins, n_plays
-    
-def test_pbp(model: PredictionModel, session, results_table=results_table):
-    """Test the play by play accuracy of the model
-    
-        returns: (wrong_predictions, n_plays, total_outcome)
-    """     
-
-    wrong_predictions = 0
-    n_plays = 0
-    total_outcome = 0.0
-
-    for play in progressbar(get_all_plays(session, training=False)):
-
-        prediction = model.predict(play)
-        prediction = int(prediction > 0.5)
-        # print(prediction) # prediction is in terms of expected batter wins
-        result = play.result
-        observed = results_table[result] 
 
-        if observed != -1:
-            total_outcome += observed
-            if observed != prediction:
-                wrong_predictions += 1
-            n_plays += 1
-            total_outcome += observed
-        
-    return wrong_predictions, n_plays, total_outcome
-
-def compute_categorical_crossentropy(model: EloModel, session):
-    # Create a mapping from float values to integer indices
-    value_to_index = {value: i for i, value in enumerate(partial_results_table.values()) if value != -1}
-    true_labels: list[int] = []
-    predicted_probs = []
-
-    testing_plays = get_all_plays(session, training=False)
-
-    for play in progressbar(testing_plays):
-        result = play.result
-        prediction, outcome_probs = model.predict_partial_outcomes(play)
-        observed = partial_results_table[result]
-        if observed != -1:
-            result_index = value_to_index[observed]
-            true_labels.append(result_index)
-            predicted_probs.append(outcome_probs)
-
-    # Convert true_labels to one-hot encoded labels
-    identity = np.eye(len(partial_results_table))
-    one_hot_labels = identity[true_labels]
+import numpy as np
+from sklearn.metrics import log_loss
 
-    # Calculate the categorical cross-entropy
-    categorical_crossentropy = log_loss(one_hot_labels, predicted_probs)
+from db_utils import create_session_scope
+from play_store import load_play_store
+from prediction_model import EloModel, DumbModel, RandomModel, partial_results_table
+from multinomial_model import MultinomialModel
+from evaluation import evaluate_models, write_report, compute_metrics, normalize_outcomes, partial_labels, score_lookup
+from bootstrap import bootstrap_model
 
-    return categorical_crossentropy
 
+def check_crossentropy(model, plays):
+    """Score one replay of the whole split with both compute_metrics and log_loss, fail if the cross-entropies differ"""
+    hit, partial, outcomes = model.copy().replay_many(plays)
+    crossentropy = compute_metrics(plays, hit, partial, outcomes)['categorical_crossentropy']
+    scored = score_lookup(partial_results_table)[plays.result] != -1
+    expected = log_loss(partial_labels(plays)[scored], normalize_outcomes(outcomes)[scored], labels=np.arange(len(partial_results_table)))
+    if not np.isclose(crossentropy, expected, rtol=1e-9):
+        raise AssertionError(f"categorical_crossentropy {crossentropy} does not match log_loss {expected}")
 
 
 def main():
     NORMAL_MODE = 0
     PARTIAL_MODE = 1
     ENTROPY_MODE = 2
+    REPORT_MODE = 3
+    BOOTSTRAP_MODE = 4
 
     modes = {
         "partial": PARTIAL_MODE,
         "normal": NORMAL_MODE,
-        "entropy": ENTROPY_MODE
+        "entropy": ENTROPY_MODE,
+        "report": REPORT_MODE,
+        "bootstrap": BOOTSTRAP_MODE,
     }
 
     try:
         mode = modes[sys.argv[1]] if len(sys.argv) > 1 else NORMAL_MODE
     except KeyError:
-        print(f"Invalid mode: {sys.argv[1]} (valid modes are: partial, normal, entropy)")
+        print(f"Invalid mode: {sys.argv[1]} (valid modes are: partial, normal, entropy, report, bootstrap)")
         exit(1)
     
     with create_session_scope() as session:
-        elo_model = EloModel(session)
-        dumb_model = DumbModel()
-        random_model = RandomModel()
-
-        if mode == PARTIAL_MODE:
-            print("TESTING PARTIAL MODE:")
-            wrong_predictions, n_plays, total_outcome = test_partial_pbp(elo_model, session)
-            print(f"Play-by-Play Inaccuracy: {wrong_predictions / n_plays}")
-
-            total_wins, expected_wins, n_plays = test_partial_lt(elo_model, session)
-            print(f"Long-term Inaccuracy: {abs(total_wins - expected_wins) / n_plays}")
-
-            total_wins, expected_wins, n_plays = test_partial_lt(dumb_model, session)
-            print(f"Baseline Long-term Inaccuracy: {abs(total_wins - expected_wins) / n_plays}")
-
-            total_wins, expected_wins, n_plays = test_partial_lt(random_model, session)
-            print(f"Random Long-term Inaccuracy: {abs(total_wins - expected_wins) / n_plays}")
-
-        if mode == ENTROPY_MODE:
-            print("TESTING ENTROPY MODE:")
-            # Calculate the categorical cross-entropy for Elo-based model
-            categorical_crossentropy = compute_categorical_crossentropy(elo_model, session)
-            print("Categorical Cross-Entropy:", categorical_crossentropy)
-
-            # Calculate the categorical cross-entropy for baseline
-            categorical_crossentropy = compute_categorical_crossentropy(dumb_model, session)
-            print("Baseline Categorical Cross-Entropy:", categorical_crossentropy)
-
-            # Calculate the categorical cross-entropy for random
-            categorical_crossentropy = compute_categorical_crossentropy(random_model, session)
-            print("Random Categorical Cross-Entropy:", categorical_crossentropy)
-        
-        if mode == NORMAL_MODE:
-
-            total_wins, expected_wins, n_plays = test_lt(elo_model, session)
-            print(f"Long-term Inaccuracy: {abs(total_wins - expected_wins) / n_plays}")
-
-            total_wins, expected_wins, n_plays = test_lt(dumb_model, session)
-            print(f"Baseline Long-term Inaccuracy: {abs(total_wins - expected_wins) / n_plays}")
-
-            total_wins, expected_wins, n_plays = test_lt(random_model, session)
-            print(f"Random Long-term Inaccuracy: {abs(total_wins - expected_wins) / n_plays}")
-
-            wrong_predictions, n_plays, total_outcome = test_pbp(elo_model, session)
-            print(f"Play-by-Play Inaccuracy: {wrong_predictions / n_plays}")
-
-            wrong_predictions, n_plays, total_outcome = test_pbp(dumb_model, session)
-            print(f"Baseline Play-by-Play Inaccuracy: {wrong_predictions / n_plays}")
+        # the test split is loaded once and every model is scored on all metrics in a single pass
+        testing_plays = load_play_store(session, training=False)
+        models = {
+            "Elo": EloModel(session),
+            "Baseline": DumbModel(),
+            "Random": RandomModel(),
+        }
+        if mode in (ENTROPY_MODE, REPORT_MODE):
+            models["Multinomial"] = MultinomialModel()
+            models["Multinomial"].fit(load_play_store(session, training=True))
+        if mode == BOOTSTRAP_MODE:
+            intervals = bootstrap_model(models["Elo"], testing_plays)
+        else:
+            report = evaluate_models(models, testing_plays)
+
+    if mode == BOOTSTRAP_MODE:
+        print("95% BOOTSTRAP CONFIDENCE INTERVALS (resampling games):")
+        for metric, interval in intervals.items():
+            print(f"{metric}: {interval['estimate']:.6f} [{interval['low']:.6f}, {interval['high']:.6f}]")
+        return
+
+    if mode == REPORT_MODE:
+        write_report(report, sys.argv[2] if len(sys.argv) > 2 else None)
+        return
+
+    elo_metrics, dumb_metrics, random_metrics = (report["models"][name] for name in ("Elo", "Baseline", "Random"))
+
+    if mode == PARTIAL_MODE:
+        print("TESTING PARTIAL MODE:")
+        print(f"Play-by-Play Inaccuracy: {elo_metrics['partial_pbp_inaccuracy']}")
+        print(f"Long-term Inaccuracy: {elo_metrics['partial_long_term_inaccuracy']}")
+        print(f"Baseline Long-term Inaccuracy: {dumb_metrics['partial_long_term_inaccuracy']}")
+        print(f"Random Long-term Inaccuracy: {random_metrics['partial_long_term_inaccuracy']}")
+
+    if mode == ENTROPY_MODE:
+        print("TESTING ENTROPY MODE:")
+        print("Categorical Cross-Entropy:", elo_metrics['categorical_crossentropy'])
+        print("Baseline Categorical Cross-Entropy:", dumb_metrics['categorical_crossentropy'])
+        print("Random Categorical Cross-Entropy:", random_metrics['categorical_crossentropy'])
+        print("Multinomial Categorical Cross-Entropy:", report["models"]["Multinomial"]['categorical_crossentropy'])
+        for model in models.values():
+            check_crossentropy(model, testing_plays)
+        print("Every cross-entropy matches log_loss")
+    
+    if mode == NORMAL_MODE:
+        print(f"Long-term Inaccuracy: {elo_metrics['long_term_inaccuracy']}")
+        print(f"Baseline Long-term Inaccuracy: {dumb_metrics['long_term_inaccuracy']}")
+        print(f"Random Long-term Inaccuracy: {random_metrics['long_term_inaccuracy']}")
 
-            wrong_predictions, n_plays, total_outcome = test_pbp(random_model, session)
-            print(f"Random Play-by-Play Inaccuracy: {wrong_predictions / n_plays}")
+        print(f"Play-by-Play Inaccuracy: {elo_metrics['pbp_inaccuracy']}")
+        print(f"Baseline Play-by-Play Inaccuracy: {dumb_metrics['pbp_inaccuracy']}")
+        print(f"Random Play-by-Play Inaccuracy: {random_metrics['pbp_inaccuracy']}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
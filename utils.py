@@ -1,9 +1,12 @@
 import math
+import numpy as np
 from progressbar import progressbar
 from models import Base, Team, Game, Play, Player, Pitcher, Batter, PitcherRating, BatterRating, Position
 from db_utils import create_session_scope, get_n_plays
 
 SIGMA = 400
+# rating every player starts from, see data_clean.initialize_ratings
+INITIAL_RATING = 1500
 
 MAX_RESULT = 4
 GROWTH_RATE = 9
@@ -28,5 +31,6 @@ def linear_func(x):
     return x / MAX_RESULT
 
 def calculate_xp(n_plays):
-    xp = max(1, 5 - (n_plays / 200))
+    # works on a single count or an array of counts
+    xp = np.maximum(1, 5 - (n_plays / 200))
     return xp
\ No newline at end of file